@@ -3,7 +3,9 @@
 #                         Imports
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 import os
-from typing import Optional
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Optional
 import aiohttp
 import asyncio
 import asyncpg
@@ -11,8 +13,13 @@ import click
 import discord
 import json
 import contextlib
+import hashlib
 import logging
+import random
+import statistics
+import string
 import sys
+import time
 import traceback
 
 from logging.handlers import RotatingFileHandler
@@ -21,7 +28,16 @@ from markdownify import markdownify as md
 
 import main.settings.config as config
 from main.Zen import Zen
+from main.cogs.compendium import models
+from main.cogs.utils.cache import ExpiringCache, KeyMode, cache
 from main.cogs.utils.db import DB
+from main.cogs.utils.formats import TabularData
+from main.models.base import Source
+from main.models.condition import Condition
+from main.models.feat import Feat
+from main.models.maneuver import Maneuver
+from main.models.spell import Spell
+from main.settings import schema
 
 # Try Import
 try:
@@ -35,6 +51,13 @@ else:
 
 BULLET_STYLE = ['-', '+', '*']
 
+# Files handed to a parsing process at a time
+PARSE_CHUNKSIZE = 8
+
+# Rows merged per transaction, and parsed batches waiting to be written
+INGEST_BATCH_SIZE = 500
+INGEST_QUEUE_SIZE = 2
+
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                          Main
@@ -128,13 +151,211 @@ def db():
 
 @db.command(short_help='Update the database.')
 @click.option('-q', '--quiet', help='Reduce output verbosity.', is_flag=True)
+@click.option('-w', '--workers', help='Processes parsing the packs.', default=os.cpu_count() or 1)
+@click.option('-f', '--force', help='Reparse files that did not change.', is_flag=True)
 @click.pass_context
-def update_db(ctx, quiet):
+def update_db(ctx, quiet, workers, force):
     """ Update the database with the latest json. """
-    asyncio.run(_update_db('feats', quiet))
+    asyncio.run(_update_db('feats', quiet, workers, force))
+
+
+@db.command(short_help='Check lookups use indexes.')
+def check_indexes():
+    """ Verify via EXPLAIN that every lookup statement uses an index. """
+    asyncio.run(_check_indexes())
+
+
+async def _check_indexes():
+    try:
+        pool = await DB.create_pool(config.uri)
+    except Exception:
+        click.echo(
+            f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
+        return
+
+    results = await DB.check_indexes(pool)
+    await pool.close()
+
+    table = TabularData()
+    table.set_columns(['Statement', 'Uses Index'])
+    table.add_rows(results.items())
+    click.echo(table.render())
+
+    if not all(results.values()):
+        sys.exit(1)
+
+
+@db.command(short_help='Re-render stale embeds.')
+def rematerialize():
+    """ Re-render materialized embeds left by an older render version. """
+    asyncio.run(_run_rematerialize())
+
+
+async def _run_rematerialize():
+    try:
+        pool = await DB.create_pool(config.uri)
+    except Exception:
+        click.echo(
+            f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
+        return
+
+    try:
+        # Rendered into shadows of the stale tables, like an ingest
+        stale = [table for table, count in (await stale_renders(pool)).items() if count]
+        if len(stale) == 0:
+            print('No stale embeds')
+            return
+
+        await create_shadow_tables(pool, stale)
+        await _rematerialize(pool, SHADOW_SUFFIX, stale)
+        await swap_shadow_tables(pool, stale, [])
+
+        # Let running bots know to reload their index
+        await pool.execute(f'NOTIFY {schema.compendium_channel}')
+    finally:
+        await drop_shadow_tables(pool, list(INGEST_COLUMNS))
+        await pool.close()
+
+
+async def _rematerialize(
+    pool, suffix: str = '', tables: Optional[list[str]] = None
+) -> int:
+    """ Re-renders every row whose embeds are missing or stale.
+
+    Rows are read in name order, one page of INGEST_BATCH_SIZE at a time, and
+    each page is written before the next is read. Returns the number of rows
+    rendered.
+    """
+    total = 0
+    for table, model in models.items():
+        if tables is not None and table not in tables:
+            continue
+
+        last = ''
+        while True:
+            rows = await pool.fetch(
+                f'''SELECT {schema.columns[table]} FROM {table}{suffix}
+                    WHERE render_version IS DISTINCT FROM $1 AND name > $2
+                    ORDER BY name
+                    LIMIT $3''', model.render_version, last, INGEST_BATCH_SIZE)
+
+            if len(rows) == 0:
+                break
+
+            print(f'Rematerializing {len(rows)} {table}')
+            embeds = [(materialize(model(r)), r['name']) for r in rows]
+            data = [(embed, stored_version(model, embed), name) for embed, name in embeds]
+            await pool.executemany(
+                f'UPDATE {table}{suffix} SET embed=$1::jsonb, render_version=$2 WHERE name=$3', data)
+
+            # Failed renders stay stale, the key moves past them
+            last = rows[-1]['name']
+            total += len(rows)
+
+    return total
+
+
+async def stale_renders(pool) -> dict[str, int]:
+    """ Number of rows per table whose embeds are missing or stale. """
+    return {
+        table: await pool.fetchval(
+            f'SELECT COUNT(*) FROM {table} WHERE render_version IS DISTINCT FROM $1',
+            model.render_version)
+        for table, model in models.items()
+    }
+
 
+def stored_version(model: type[Source], embed: Optional[list[dict]]) -> Optional[int]:
+    """ Render version stored with the embeds, NULL keeps a failed render stale. """
+    return model.render_version if embed is not None else None
 
-async def _update_db(compendium, quiet):
+
+def materialize(model: Source) -> Optional[list[dict]]:
+    """ Renders the embeds of a model, None if rendering fails. """
+    try:
+        return model.materialize()
+    except Exception:
+        print(f'Could not render {model.name}.\n{traceback.format_exc()}', file=sys.stderr)
+        return None
+
+
+def pack_files(pack: str) -> list[str]:
+    """ Json files of a pack, sorted so every ingest reads them in the same order. """
+    return sorted(
+        f'./.packs/{pack}/{file}' for file in os.listdir(f'./.packs/{pack}') if file.endswith('.json'))
+
+
+def file_hash(file: str) -> str:
+    with open(file, 'rb') as reader:
+        return hashlib.blake2b(reader.read(), digest_size=16).hexdigest()
+
+
+def row_hash(*values: Any) -> str:
+    """ Digest of the parsed columns, the rendered embeds are left out. """
+    payload = json.dumps(values, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+async def changed_files(pool, pack: str, force: bool = False) -> list[tuple[str, str]]:
+    """ Returns the (path, hash) of every file of a pack that changed since the last ingest. """
+    files = pack_files(pack)
+    hashes = {file: file_hash(file) for file in files}
+
+    if not force:
+        stored = await pool.fetch(
+            'SELECT path, hash FROM ingest_files WHERE path = ANY($1::text[])', files)
+        known = {r['path']: r['hash'] for r in stored}
+        files = [file for file in files if known.get(file) != hashes[file]]
+
+    return [(file, hashes[file]) for file in files]
+
+
+async def _stream_packs(
+    pool, packs: list[tuple], changed: dict[str, list[tuple[str, str]]],
+    executor: Optional[Executor] = None
+) -> list[tuple[str, str]]:
+    """ Parses the changed files of every pack and merges them into the shadow tables.
+
+    Parsed batches go through a bounded queue, so the next batch is parsed
+    while the previous one is written and at most a few batches are held in
+    memory. Returns the (path, hash) of every file written.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    written: list[tuple[str, str]] = list()
+
+    async def produce():
+        for pack, _, reader, *args in packs:
+            if len(changed[pack]) == 0:
+                print(f'{pack} unchanged')
+                continue
+
+            files = [file for file, _ in changed[pack]]
+            table, batches = reader(files, *args, executor=executor)
+            async for rows in batches:
+                await queue.put((table, rows))
+            written.extend(changed[pack])
+
+        await queue.put(None)
+
+    async def consume():
+        async with pool.acquire() as conn:
+            while (batch := await queue.get()) is not None:
+                table, rows = batch
+                async with conn.transaction():
+                    await copy_merge(conn, table, rows, target=f'{table}{SHADOW_SUFFIX}')
+
+    # Either side failing stops the other instead of leaving it waiting on the queue
+    tasks = {asyncio.create_task(produce()), asyncio.create_task(consume())}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        task.result()
+
+    return written
+
+
+async def _update_db(compendium, quiet, workers: int = 1, force: bool = False):
     # TODO: Add downloading new files
 
     # Open db connection
@@ -145,206 +366,615 @@ async def _update_db(compendium, quiet):
             f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
         return
 
-    # Update Conditions
-    conditions = [file for file in os.listdir(
-        f'./.packs/conditions') if file.endswith('.json')]
-    files = {f'./.packs/conditions/{c}' for c in conditions}
-    sql, data = get_condition_data(files)
-    await pool.executemany(sql, data)
-
-    # Update Feats
-    feats = [file for file in os.listdir(
-        f'./.packs/feats') if file.endswith('.json')]
-    files = {f'./.packs/feats/{f}' for f in feats}
-    sql, data = get_feat_data(files)
-    await pool.executemany(sql, data)
-
-    synergyFeats = [file for file in os.listdir(
-        f'./.packs/synergyFeats') if file.endswith('.json')]
-    files = {f'./.packs/synergyFeats/{f}' for f in synergyFeats}
-    sql, data = get_feat_data(files, 'synergy')
-    await pool.executemany(sql, data)
-
-    # Update Maneuvers
-    maneuvers = [file for file in os.listdir(
-        f'./.packs/maneuvers') if file.endswith('.json')]
-    files = {f'./.packs/maneuvers/{m}' for m in maneuvers}
-    sql, data = get_maneuver_data(files)
-    await pool.executemany(sql, data)
-
-    # Update Spells
-    spells = [file for file in os.listdir(
-        f'./.packs/spells') if file.endswith('.json')]
-    files = {f'./.packs/spells/{s}' for s in spells}
-    sql, data = get_spell_data(files)
-    await pool.executemany(sql, data)
-
-    rareSpells = [file for file in os.listdir(
-        f'./.packs/rareSpells') if file.endswith('.json')]
-    files = {f'./.packs/rareSpells/{s}' for s in rareSpells}
-    sql, data = get_spell_data(files, 'rare')
-    await pool.executemany(sql, data)
+    # Markdown conversion is CPU bound, spread the files over processes
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    packs = [
+        ('conditions', 'conditions', get_condition_data),
+        ('feats', 'feats', get_feat_data),
+        ('synergyFeats', 'feats', get_feat_data, 'synergy'),
+        ('maneuvers', 'maneuvers', get_maneuver_data),
+        ('spells', 'spells', get_spell_data),
+        ('rareSpells', 'spells', get_spell_data, 'rare'),
+    ]
+
+    try:
+        # Only tables with a changed file or a stale render are copied and swapped
+        changed = {pack: await changed_files(pool, pack, force) for pack, *_ in packs}
+        stale = await stale_renders(pool)
+        tables = [
+            table for table in INGEST_COLUMNS
+            if stale[table] or any(changed[pack] for pack, t, *_ in packs if t == table)
+        ]
+        if len(tables) == 0:
+            print('Compendium is up to date')
+            return
+
+        # The live tables are left alone until the swap
+        await create_shadow_tables(pool, tables)
+        written = await _stream_packs(pool, packs, changed, executor)
+
+        # Render rows the packs did not touch but whose embeds are stale
+        await _rematerialize(pool, SHADOW_SUFFIX, tables)
+        await swap_shadow_tables(pool, tables, written)
+
+        # Let running bots know to reload their index
+        await pool.execute(f'NOTIFY {schema.compendium_channel}')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+        await drop_shadow_tables(pool, list(INGEST_COLUMNS))
+        await pool.close()
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-#                      Feat Readers
+#                       Bulk Writes
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# Columns written by the ingest, in the order the readers emit them
+INGEST_COLUMNS: dict[str, tuple[str, ...]] = {
+    'conditions': ('name', 'description', 'embed', 'render_version', 'row_hash'),
+    'feats': ('name', 'description', 'type', 'embed', 'render_version', 'row_hash'),
+    'maneuvers': ('name', 'description', 'extra', 'embed', 'render_version', 'row_hash'),
+    'spells': ('name', 'description', 'type', 'extra', 'embed', 'render_version', 'row_hash'),
+}
+JSONB_COLUMNS = {'extra', 'embed'}
+INTEGER_COLUMNS = {'render_version'}
+
+
+def _merge_clause(table: str, target: str) -> str:
+    updates = ', '.join(f'{c}=EXCLUDED.{c}' for c in INGEST_COLUMNS[table] if c != 'name')
+    return f'''ON CONFLICT (name)
+               DO UPDATE SET {updates}
+               WHERE {target}.row_hash IS DISTINCT FROM EXCLUDED.row_hash'''
+
+
+def upsert_sql(table: str, target: Optional[str] = None) -> str:
+    """ Single row upsert of the ingest columns, for executemany. """
+    target = target or table
+    columns = INGEST_COLUMNS[table]
+    values = ', '.join(
+        f'${i}::jsonb' if c in JSONB_COLUMNS else f'${i}' for i, c in enumerate(columns, 1))
+
+    return f'''INSERT INTO {target}({', '.join(columns)})
+               VALUES({values})
+               {_merge_clause(table, target)}'''
+
+
+async def copy_merge(conn, table: str, rows: list[tuple], target: Optional[str] = None) -> None:
+    """ Streams rows into a staging table and merges them with one statement.
+
+    Must run inside a transaction, the staging table is dropped on commit.
+    """
+    target = target or table
+    columns = INGEST_COLUMNS[table]
+    staging = f'{target}_staging'
+    definition = ', '.join(
+        f'{c} INTEGER' if c in INTEGER_COLUMNS else f'{c} TEXT' for c in columns)
+    await conn.execute(f'CREATE TEMP TABLE {staging}({definition}) ON COMMIT DROP')
+
+    # COPY skips the jsonb codec, encode those columns here. The last row of a
+    # name wins, like sequential upserts, since one merge cannot touch a row twice
+    jsonb = [i for i, c in enumerate(columns) if c in JSONB_COLUMNS]
+    latest: dict[str, tuple] = {}
+    for row in rows:
+        if jsonb:
+            row = list(row)
+            for i in jsonb:
+                if row[i] is not None:
+                    row[i] = json.dumps(row[i])
+            row = tuple(row)
+        latest[row[0]] = row
+
+    await conn.copy_records_to_table(staging, records=latest.values(), columns=columns)
+
+    select = ', '.join(f'{c}::jsonb' if c in JSONB_COLUMNS else c for c in columns)
+    await conn.execute(f'''INSERT INTO {target}({', '.join(columns)})
+                           SELECT {select} FROM {staging}
+                           {_merge_clause(table, target)}''')
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                      Shadow Tables
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+SHADOW_SUFFIX = '__next'
+SWAP_LOCK_TIMEOUT = '75ms'
+SWAP_ATTEMPTS = 40
+
+
+async def create_shadow_tables(pool, tables: list[str]) -> None:
+    """ Creates a copy of every table, with its indexes, to ingest into. """
+    async with pool.acquire() as conn:
+        for table in tables:
+            shadow = f'{table}{SHADOW_SUFFIX}'
+            stored = await conn.fetch(
+                '''SELECT column_name FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = $1
+                   AND is_generated = 'NEVER'
+                   ORDER BY ordinal_position''', table)
+            columns = ', '.join(r['column_name'] for r in stored)
+
+            await conn.execute(f'DROP TABLE IF EXISTS {shadow}')
+            await conn.execute(f'CREATE TABLE {shadow} (LIKE {table} INCLUDING ALL)')
+            await conn.execute(f'INSERT INTO {shadow}({columns}) SELECT {columns} FROM {table}')
+
+
+async def drop_shadow_tables(pool, tables: list[str]) -> None:
+    for table in tables:
+        await pool.execute(f'DROP TABLE IF EXISTS {table}{SHADOW_SUFFIX}')
+
+
+def _index_shape(definition: str) -> str:
+    """ Index definition without its name and table, e.g. 'UNIQUE btree (name)'. """
+    kind, _, rest = definition.partition(' INDEX ')
+    return f"{kind.removeprefix('CREATE').strip()} {rest.split(' USING ', 1)[1]}".strip()
+
+
+async def _index_names(conn, table: str) -> dict[str, list[str]]:
+    indexes = await conn.fetch(
+        '''SELECT indexname, indexdef FROM pg_indexes
+           WHERE schemaname = current_schema() AND tablename = $1
+           ORDER BY indexname''', table)
+
+    names: dict[str, list[str]] = dict()
+    for index in indexes:
+        names.setdefault(_index_shape(index['indexdef']), []).append(index['indexname'])
+
+    return names
+
+
+async def swap_shadow_tables(pool, tables: list[str], written: list[tuple[str, str]]) -> None:
+    """ Publishes every shadow table in one transaction.
+
+    The renames need an exclusive lock, and lookups queue behind a pending
+    one. Every table is locked up front with a lock timeout of a few tens of
+    milliseconds, so lookups wait at most that long, and a swap that cannot
+    get its locks backs off and retries instead.
+    """
+    for table in tables:
+        await pool.execute(f'ANALYZE {table}{SHADOW_SUFFIX}')
+
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+                    await conn.execute(
+                        f'LOCK TABLE {", ".join(tables)} IN ACCESS EXCLUSIVE MODE')
+                    for table in tables:
+                        await _swap_table(conn, table)
+
+                    # Hashes are only recorded along with the rows they describe
+                    await conn.executemany(
+                        '''INSERT INTO ingest_files(path, hash) VALUES($1, $2)
+                           ON CONFLICT (path)
+                           DO UPDATE SET hash=$2, ingested_at=(now() at time zone 'utc')''',
+                        written)
+        except asyncpg.LockNotAvailableError:
+            print(f'Swap blocked, retrying ({attempt}/{SWAP_ATTEMPTS})')
+            await asyncio.sleep(min(0.05 * attempt, 1.0) * random.uniform(0.5, 1.5))
+        else:
+            print(f'Swapped in {len(tables)} tables')
+            return
+
+    raise RuntimeError(f'Could not swap in the shadow tables after {SWAP_ATTEMPTS} attempts.')
+
+
+async def _swap_table(conn, table: str) -> None:
+    old, shadow = f'{table}__old', f'{table}{SHADOW_SUFFIX}'
+    await conn.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    await conn.execute(f'ALTER TABLE {shadow} RENAME TO {table}')
+
+    # Give the new indexes the names migrations and checks expect
+    canonical = await _index_names(conn, old)
+    current = await _index_names(conn, table)
+    await conn.execute(f'DROP TABLE {old}')
+
+    for shape, names in current.items():
+        for name, wanted in zip(names, canonical.get(shape, [])):
+            if name != wanted:
+                await conn.execute(f'ALTER INDEX {name} RENAME TO {wanted}')
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                      Pack Readers
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+async def parse_batches(
+    parse: Callable[..., tuple], files: list[str], executor: Optional[Executor], *args: Any
+) -> AsyncIterator[list[tuple]]:
+    """ Yields the parsed rows in batches of INGEST_BATCH_SIZE, in the order of `files`. """
+    loop = asyncio.get_running_loop()
+    parse = partial(parse, *args) if args else parse
+
+    for start in range(0, len(files), INGEST_BATCH_SIZE):
+        batch = files[start:start + INGEST_BATCH_SIZE]
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(executor, parse_chunk, parse, batch[i:i + PARSE_CHUNKSIZE])
+            for i in range(0, len(batch), PARSE_CHUNKSIZE)
+        ))
+
+        for file in batch:
+            print(file)
+        yield [row for chunk in chunks for row in chunk]
+
+
+def parse_chunk(parse: Callable[[str], tuple], files: list[str]) -> list[tuple]:
+    return [parse(file) for file in files]
+
+
+def read_pack(file: str) -> dict:
+    with open(file, 'r', encoding='utf8') as reader:
+        return json.load(reader)
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                    Condition Reader
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-def get_condition_data(files: list[str]) -> tuple[str, list[tuple[str, str]]]:
-    """ Generates sql for feats from files"""
+def get_condition_data(
+    files: list[str], executor: Optional[Executor] = None
+) -> tuple[str, AsyncIterator[list[tuple]]]:
+    """ Streams batches of rows for conditions from files"""
     print('====================================')
     print(f'Conditions')
     print('====================================')
 
-    sql: str = ''' INSERT INTO conditions(name, description)
-                   VALUES($1, $2)
-                   ON CONFLICT (name)
-                   DO UPDATE SET description=$2
-               '''
-    sql_data: list[tuple[str, str]] = list()
+    return ('conditions', parse_batches(parse_condition, files, executor))
 
-    for file in files:
-        with open(file, 'r', encoding='utf8') as reader:
-            print(file)
-            data = json.load(reader)
 
-            # Structure for db input
-            name: str = data['name']
-            description: str = md(
-                data['description'], bullets=BULLET_STYLE)
+def parse_condition(file: str) -> tuple:
+    data = read_pack(file)
 
-            sql_data.append((name, description))
+    # Structure for db input
+    name: str = data['name']
+    description: str = md(
+        data['description'], bullets=BULLET_STYLE)
 
-    return (sql, sql_data)
+    embed = materialize(Condition.from_record(name, description))
+
+    return (
+        name, description, embed, stored_version(Condition, embed),
+        row_hash(name, description))
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                      Feat Readers
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def get_feat_data(
-    files: list[str], type: Optional[str] = None
-) -> tuple[str, list[tuple[str, str]]]:
-    """ Generates sql for feats from files"""
+    files: list[str], type: Optional[str] = None, executor: Optional[Executor] = None
+) -> tuple[str, AsyncIterator[list[tuple]]]:
+    """ Streams batches of rows for feats from files"""
     print('====================================')
     print(f'Feats - {"{type}" if type == "synergy" else ""}')
     print('====================================')
 
-    sql: str = ''' INSERT INTO feats(name, description, type)
-                   VALUES($1, $2, $3)
-                   ON CONFLICT (name)
-                   DO UPDATE SET description=$2,
-                                 type=$3
-               '''
-    sql_data: list[tuple[str, str]] = list()
 
-    for file in files:
-        with open(file, 'r', encoding='utf8') as reader:
-            print(file)
-            data = json.load(reader)
+    return ('feats', parse_batches(parse_feat, files, executor, type))
 
-            # Structure for db input
-            name: str = data['name']
-            description: str = md(
-                data['data']['description'], bullets=BULLET_STYLE)
 
-            sql_data.append((name, description, type))
+def parse_feat(type: Optional[str], file: str) -> tuple:
+    data = read_pack(file)
 
-    return (sql, sql_data)
+    # Structure for db input
+    name: str = data['name']
+    description: str = md(
+        data['data']['description'], bullets=BULLET_STYLE)
+
+    embed = materialize(Feat.from_record(name, description, type))
+
+    return (
+        name, description, type, embed, stored_version(Feat, embed),
+        row_hash(name, description, type))
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                      Maneuver Reader
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-def get_maneuver_data(files: list[str]) -> tuple[str, list[tuple[str, str]]]:
-    """ Generates sql for spells from files"""
+def get_maneuver_data(
+    files: list[str], executor: Optional[Executor] = None
+) -> tuple[str, AsyncIterator[list[tuple]]]:
+    """ Streams batches of rows for maneuvers from files"""
     print('====================================')
     print('Maneuvers')
     print('====================================')
-    sql: str = ''' INSERT INTO maneuvers(name, description, extra)
-                   VALUES($1, $2, $3::jsonb)
-                   ON CONFLICT (name)
-                   DO UPDATE SET description=$2,
-                                 extra=$3::jsonb
-               '''
-    sql_data: list[tuple[str, str]] = list()
-
-    for file in files:
-        with open(file, 'r', encoding='utf8') as reader:
-            print(file)
-            data = json.load(reader)
 
-            # Structure for db input
-            name: str = data['name']
-            description: str = md(
-                data['data']['description'], bullets=BULLET_STYLE)
-            system = data['data']
+    return ('maneuvers', parse_batches(parse_maneuver, files, executor))
+
+
+def parse_maneuver(file: str) -> tuple:
+    data = read_pack(file)
 
-            extras = {
-                'activation': system['activation'],
-                'degree': system['degree'],
-                'exertionCost': system['exertionCost'],
-                'tradition': system['tradition']
-            }
+    # Structure for db input
+    name: str = data['name']
+    description: str = md(
+        data['data']['description'], bullets=BULLET_STYLE)
+    system = data['data']
 
-            sql_data.append((name, description, extras))
+    extras = {
+        'activation': system['activation'],
+        'degree': system['degree'],
+        'exertionCost': system['exertionCost'],
+        'tradition': system['tradition']
+    }
 
-    return (sql, sql_data)
+    embed = materialize(Maneuver.from_record(name, description, extras))
+
+    return (
+        name, description, extras, embed, stored_version(Maneuver, embed),
+        row_hash(name, description, extras))
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                      Spell Reader
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def get_spell_data(
-    files: list[str], type: Optional[str] = None
-) -> tuple[str, list[tuple[str, str]]]:
-    """ Generates sql for spells from files"""
+    files: list[str], type: Optional[str] = None, executor: Optional[Executor] = None
+) -> tuple[str, AsyncIterator[list[tuple]]]:
+    """ Streams batches of rows for spells from files"""
     print('====================================')
     print(f'Spells - {"{type}" if type == "rare" else ""}')
     print('====================================')
-    sql: str = ''' INSERT INTO spells(name, description, type, extra)
-                   VALUES($1, $2, $3, $4::jsonb)
-                   ON CONFLICT (name)
-                   DO UPDATE SET description=$2,
-                                 type=$3,
-                                 extra=$4::jsonb
-               '''
-    sql_data: list[tuple[str, str]] = list()
-
-    for file in files:
-        with open(file, 'r', encoding='utf8') as reader:
-            print(file)
-            data = json.load(reader)
-
-            # Structure for db input
-            name: str = data['name']
-            description: str = md(
-                data['data']['description'], bullets=BULLET_STYLE)
-            system = data['data']
-
-            extras = {
-                'area': system['area'],
-                'castingTime': system['activation'],
-                'classes': None,
-                'components': system['components'],
-                'concentration': system['concentration'],
-                'duration': system['duration'],
-                'materials': f"{system['materials']} {'which the spell consumes.' if system['materials'] else ''}",
-                'level': system['level'],
-                'primarySchool': system['schools']['primary'],
-                'range': system['range'],
-                'ritual': system['ritual'],
-                'savingThrow': f"{system['save']['targetAbility'].capitalize()} {'Halves' if 'half damage' in system['save']['onSave'].lower() else 'Negates'}",
-                'secondarySchool': system['schools']['secondary'],
-                'target': system['target'],
-            }
-
-            sql_data.append((name, description, type, extras))
-
-    return (sql, sql_data)
+
+    return ('spells', parse_batches(parse_spell, files, executor, type))
+
+
+def parse_spell(type: Optional[str], file: str) -> tuple:
+    data = read_pack(file)
+
+    # Structure for db input
+    name: str = data['name']
+    description: str = md(
+        data['data']['description'], bullets=BULLET_STYLE)
+    system = data['data']
+
+    extras = {
+        'area': system['area'],
+        'castingTime': system['activation'],
+        'classes': None,
+        'components': system['components'],
+        'concentration': system['concentration'],
+        'duration': system['duration'],
+        'materials': f"{system['materials']} {'which the spell consumes.' if system['materials'] else ''}",
+        'level': system['level'],
+        'primarySchool': system['schools']['primary'],
+        'range': system['range'],
+        'ritual': system['ritual'],
+        'savingThrow': f"{system['save']['targetAbility'].capitalize()} {'Halves' if 'half damage' in system['save']['onSave'].lower() else 'Negates'}",
+        'secondarySchool': system['schools']['secondary'],
+        'target': system['target'],
+    }
+
+    embed = materialize(Spell.from_record(name, description, type, extras))
+
+    return (
+        name, description, type, extras, embed, stored_version(Spell, embed),
+        row_hash(name, description, type, extras))
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-#                         Imports
+#                        Benchmarks
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+@main.group(short_help='benchmarks', options_metavar='[options]')
+def bench():
+    pass
+
+
+def _percentiles(samples: list[float]) -> tuple[float, float]:
+    """ Returns the p50 and p99 of samples in milliseconds. """
+    cuts = statistics.quantiles(samples, n=100)
+    return (cuts[49] * 1000.0, cuts[98] * 1000.0)
+
+
+def _render_bench(results: dict[str, list[float]]) -> None:
+    table = TabularData()
+    table.set_columns(['Path', 'p50 (ms)', 'p99 (ms)'])
+    for path, samples in results.items():
+        p50, p99 = _percentiles(samples)
+        table.add_row([path, f'{p50:.3f}', f'{p99:.3f}'])
+
+    click.echo(table.render())
+
+
+def _synthetic_names(count: int) -> list[str]:
+    """ Generates unique spell-like names. """
+    rng = random.Random(0)
+    names: set[str] = set()
+    while len(names) < count:
+        words = [
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).capitalize()
+            for _ in range(rng.randint(1, 3))
+        ]
+        names.add(' '.join(words))
+
+    return sorted(names)
+
+
+@bench.command(short_help='Benchmark compendium lookups.')
+@click.option('-n', '--rows', help='Size of the synthetic compendium.', default=5000)
+@click.option('-i', '--iterations', help='Lookups per path.', default=2000)
+def lookup(rows, iterations):
+    """ Compare the two-step and single statement lookup paths. """
+    asyncio.run(_bench_lookup(rows, iterations))
+
+
+async def _bench_lookup(rows: int, iterations: int):
+    table = 'bench_compendium'
+    pool = await asyncpg.create_pool(config.uri)
+
+    try:
+        names = _synthetic_names(rows)
+        await pool.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+        await pool.execute(f'DROP TABLE IF EXISTS {table}')
+        await pool.execute(f'CREATE TABLE {table}(name TEXT PRIMARY KEY, description TEXT NOT NULL)')
+        await pool.execute(f'CREATE INDEX ON {table} USING GIN (name gin_trgm_ops)')
+        await pool.execute(f'CREATE INDEX ON {table} (LOWER(name))')
+        await pool.copy_records_to_table(
+            table, records=[(n, n) for n in names], columns=['name', 'description'])
+        await pool.execute(f'ANALYZE {table}')
+
+        # Half exact hits, half misspellings
+        rng = random.Random(1)
+        queries = []
+        for _ in range(iterations):
+            name = rng.choice(names).lower()
+            if rng.random() < 0.5:
+                idx = rng.randrange(len(name))
+                name = name[:idx] + name[idx + 1:]
+            queries.append(name)
+
+        exact = f'SELECT * FROM {table} WHERE LOWER(name)=$1'
+        fuzzy = f'''SELECT * FROM {table} WHERE name % $1
+                     ORDER BY similarity(name, $1) DESC LIMIT 15'''
+        combined = schema.lookup.format(entity=table, columns='*')
+
+        results: dict[str, list[float]] = {'two-step': [], 'combined': []}
+        for query in queries:
+            start = time.perf_counter()
+            if await pool.fetchrow(exact, query) is None:
+                await pool.fetch(fuzzy, query)
+            results['two-step'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await pool.fetch(combined, query)
+            results['combined'].append(time.perf_counter() - start)
+
+        _render_bench(results)
+
+    finally:
+        await pool.execute(f'DROP TABLE IF EXISTS {table}')
+        await pool.close()
+
+
+@bench.command(short_help='Benchmark ingest writes.')
+@click.option('-n', '--rows', help='Rows per run, repeatable.', multiple=True,
+              type=int, default=[1000, 10000, 100000])
+def ingest(rows):
+    """ Compare executemany upserts against COPY into a staging table. """
+    asyncio.run(_bench_ingest(rows))
+
+
+def _synthetic_spells(count: int) -> list[tuple]:
+    """ Generates spell rows in ingest column order. """
+    rng = random.Random(2)
+    rows = []
+    for name in _synthetic_names(count):
+        description = ' '.join([name] * rng.randint(20, 80))
+        extras = {
+            'level': rng.randint(0, 9),
+            'primarySchool': rng.choice(['Evocation', 'Divination', 'Transmutation']),
+            'ritual': rng.random() < 0.1,
+            'concentration': rng.random() < 0.4,
+        }
+        embed = [{'title': name, 'description': description, 'type': 'rich'}]
+        rows.append((name, description, None, extras, embed, Spell.render_version,
+                     row_hash(name, description, None, extras)))
+
+    return rows
+
+
+async def _bench_ingest(sizes: tuple[int, ...]):
+    table = 'bench_spells'
+    pool = await DB.create_pool(config.uri)
+
+    try:
+        await pool.execute(f'DROP TABLE IF EXISTS {table}')
+        await pool.execute(f'CREATE TABLE {table} (LIKE spells INCLUDING ALL)')
+
+        results = TabularData()
+        results.set_columns(['Rows', 'Path', 'Seconds', 'Rows/s'])
+        for size in sizes:
+            rows = _synthetic_spells(size)
+            for path in ('executemany', 'copy'):
+                await pool.execute(f'TRUNCATE {table}')
+
+                start = time.perf_counter()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        if path == 'copy':
+                            await copy_merge(conn, 'spells', rows, target=table)
+                        else:
+                            await conn.executemany(upsert_sql('spells', target=table), rows)
+                elapsed = time.perf_counter() - start
+
+                results.add_row([size, path, f'{elapsed:.3f}', f'{size / elapsed:,.0f}'])
+
+        click.echo(results.render())
+
+    finally:
+        await pool.execute(f'DROP TABLE IF EXISTS {table}')
+        await pool.close()
+
+
+@bench.command(short_help='Benchmark ExpiringCache access.')
+@click.option('-i', '--iterations', help='Accesses per size.', default=100000)
+def expiring_cache(iterations):
+    """ Show that ExpiringCache access cost stays flat as the cache grows. """
+    table = TabularData()
+    table.set_columns(['Entries', 'get (ns)', 'set (ns)', 'contains (ns)'])
+
+    for size in (1_000, 10_000, 100_000):
+        cache = ExpiringCache(3600.0)
+        for i in range(size):
+            cache[i] = i
+
+        keys = [random.randrange(size) for _ in range(iterations)]
+        row = [size]
+
+        start = time.perf_counter()
+        for k in keys:
+            cache[k]
+        row.append(f'{(time.perf_counter() - start) / iterations * 1e9:.0f}')
+
+        start = time.perf_counter()
+        for k in keys:
+            cache[k] = k
+        row.append(f'{(time.perf_counter() - start) / iterations * 1e9:.0f}')
+
+        start = time.perf_counter()
+        for k in keys:
+            k in cache
+        row.append(f'{(time.perf_counter() - start) / iterations * 1e9:.0f}')
+
+        table.add_row(row)
+
+    click.echo(table.render())
+
+
+@bench.command(short_help='Benchmark cache keying.')
+@click.option('-i', '--iterations', help='Calls per mode.', default=100000)
+def cache_keys(iterations):
+    """ Compare string and tuple cache keys for compendium style calls. """
+
+    class Cog:
+        def render(self, entity: str, name: str, version: str) -> str:
+            return name
+
+    names = _synthetic_names(500)
+    calls = [('spells', random.choice(names), 'a3f9c2d18e7b6054')
+             for _ in range(iterations)]
+
+    table = TabularData()
+    table.set_columns(['Mode', 'key (ns)', 'hit (ns)'])
+
+    for mode in (KeyMode.string, KeyMode.tuple):
+        cog = Cog()
+        func = cache(maxsize=1024, key_mode=mode)(Cog.render)
+        for call in calls:
+            func(cog, *call)
+
+        start = time.perf_counter()
+        for call in calls:
+            func.get_key(cog, *call)
+        key = (time.perf_counter() - start) / iterations * 1e9
+
+        start = time.perf_counter()
+        for call in calls:
+            func(cog, *call)
+        hit = (time.perf_counter() - start) / iterations * 1e9
+
+        table.add_row([mode.name, f'{key:.0f}', f'{hit:.0f}'])
+
+    click.echo(table.render())
+
+
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                          Init
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
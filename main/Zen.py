@@ -25,6 +25,7 @@ from discord.ext import commands
 
 # Local application imports
 import main.settings.config as config
+from main.cogs.utils import cache
 from main.cogs.utils.config import Config
 from main.cogs.utils.context import Context
 
@@ -33,6 +34,9 @@ from main.cogs.utils.context import Context
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 description = "A5E BOT WIP"
 
+# Hottest cache entries, kept across restarts
+CACHE_SNAPSHOT = 'main/settings/caches.pickle'
+
 log = logging.getLogger(__name__)
 
 
@@ -141,6 +145,9 @@ class Zen(commands.AutoShardedBot):
                 print(f'Failed to load cog {cog}.', file=sys.stderr)
                 traceback.print_exc()
 
+        # Warm the caches once the compendium is loaded
+        cache.load_snapshot(CACHE_SNAPSHOT, self.compendium_version)
+
         # Set Status
         self.activity = discord.Activity(
             name=config.activity, type=discord.ActivityType.watching)
@@ -155,6 +162,14 @@ class Zen(commands.AutoShardedBot):
     def owner(self) -> discord.User:
         return self.bot_app_info.owner
 
+    @property
+    def compendium_version(self) -> str:
+        """ Version of the loaded compendium, empty when it is not loaded. """
+        cog = self.get_cog('Compendium')
+        if cog is None:
+            return ''
+        return cog.version
+
     def _clear_gateway_data(self) -> None:
         one_week_ago = discord.utils.utcnow() - datetime.timedelta(days=7)
         for shard_id, dates in self.identifies.items():
@@ -401,6 +416,14 @@ class Zen(commands.AutoShardedBot):
             await guild.leave()
 
     async def close(self) -> None:
+        # Before the extensions are unloaded along with the compendium
+        version = self.compendium_version
+        if version:
+            try:
+                cache.save_snapshot(CACHE_SNAPSHOT, version)
+            except OSError:
+                log.warning('Could not save the cache snapshot.', exc_info=True)
+
         await super().close()
         await self.session.close()
 
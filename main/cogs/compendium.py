@@ -8,7 +8,8 @@ import asyncio
 import logging
 import re
 
-from typing import TYPE_CHECKING, Optional, TypedDict
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Optional, TypedDict
 
 # Third party imports
 import discord  # noqa
@@ -18,13 +19,20 @@ from discord.ext import commands
 from main.models.condition import Condition
 
 # Local application imports
+from main.cogs.utils import cache
+from main.cogs.utils.db import PreparedStatements
+from main.cogs.utils.formats import ordinal
+from main.cogs.utils.index import CompendiumIndex
+from main.cogs.utils.paginator import SimplePages
+from main.models.base import Source
 from main.models.feat import Feat
-from main.models.maneuver import Maneuver
-from main.models.spell import Spell
+from main.models.maneuver import Maneuver, ManeuverTraditions
+from main.models.spell import Spell, SpellSchools
+from main.settings import schema
 
 # Local application imports
 if TYPE_CHECKING:
-    from asyncpg import Record
+    from asyncpg import Connection, Record
     from main.Zen import Zen
     from main.cogs.utils.context import Context
 
@@ -32,6 +40,22 @@ if TYPE_CHECKING:
 log = logging.getLogger(__name__)
 
 
+# Remembered misses per entity
+NEGATIVE_TTL: float = 3600.0
+NEGATIVE_MAXSIZE: int = 1024
+
+# Memory budget of the rendered embeds
+RENDER_MAX_BYTES: int = 4 * 1024 * 1024
+
+
+models: dict[str, type[Source]] = {
+    'feats': Feat,
+    'conditions': Condition,
+    'maneuvers': Maneuver,
+    'spells': Spell,
+}
+
+
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                        Lookup View
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -97,11 +121,118 @@ class LookupView(discord.ui.View):
 class Compendium(commands.Cog):
     def __init__(self, bot: Zen) -> None:
         self.bot: Zen = bot
+        self.index: CompendiumIndex = CompendiumIndex(schema.tables.keys())
+        self._listener: Optional[Connection] = None
+        self._listen_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Normalized queries that matched nothing, per entity
+        self._misses: dict[str, cache.ExpiringCache] = {
+            entity: cache.ExpiringCache(NEGATIVE_TTL, NEGATIVE_MAXSIZE)
+            for entity in (*self.index.entities, 'any')
+        }
+        self.miss_hits: Counter[str] = Counter()
 
     @property
     def display_emoji(self) -> discord.PartialEmoji:
         return discord.PartialEmoji(name='\N{VIDEO GAME}')
 
+    async def cog_load(self) -> None:
+        await self.index.load(self.bot.pool)
+
+        # Reload the index whenever an ingest finishes
+        await self._listen()
+
+    async def cog_unload(self) -> None:
+        for task in (self._listen_task, self._refresh_task):
+            if task is not None:
+                task.cancel()
+
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+
+        listener.remove_termination_listener(self._on_listener_terminated)
+        await listener.remove_listener(
+            schema.compendium_channel, self._on_compendium_updated)
+        await self.bot.pool.release(listener)
+
+    async def _listen(self) -> None:
+        """ Listens for finished ingests on a dedicated connection. """
+        listener = await self.bot.pool.acquire()
+        try:
+            await listener.add_listener(
+                schema.compendium_channel, self._on_compendium_updated)
+        except BaseException:
+            await self.bot.pool.release(listener)
+            raise
+
+        listener.add_termination_listener(self._on_listener_terminated)
+        self._listener = listener
+
+    async def _relisten(self) -> None:
+        """ Replaces a dropped listener connection, retrying until it succeeds. """
+        old, self._listener = self._listener, None
+        if old is not None:
+            try:
+                await self.bot.pool.release(old)
+            except Exception:
+                log.debug('Could not release the dropped listener connection.', exc_info=True)
+
+        delay = 1.0
+        while True:
+            try:
+                await self._listen()
+            except Exception:
+                log.exception(f'Could not listen for compendium updates, retrying in {delay:.0f}s.')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+            else:
+                break
+
+        # Updates sent while disconnected were lost
+        await self.refresh()
+
+    def _on_listener_terminated(self, conn) -> None:
+        if self._listener is None:
+            return
+
+        log.warning('Compendium listener connection closed, reconnecting.')
+        self._listen_task = asyncio.create_task(self._relisten())
+
+    def _on_compendium_updated(self, conn, pid, channel, payload) -> None:
+        log.info('Compendium updated, reloading index.')
+        self._refresh_task = asyncio.create_task(self.refresh())
+
+    @property
+    def version(self) -> str:
+        """ Version of the indexed rows and of the models rendering them. """
+        if not self.index.version:
+            return ''
+
+        renders = ','.join(f'{entity}={model.render_version}' for entity, model in models.items())
+        return f'{self.index.version}:{renders}'
+
+    async def refresh(self) -> None:
+        """ Reloads the index and forgets every remembered miss.
+
+        Failures are logged and the previous index keeps being served.
+        """
+        version = self.index.version
+        try:
+            await self.index.load(self.bot.pool)
+        except Exception:
+            log.exception('Could not reload the compendium index, serving the previous one.')
+            return
+
+        if self.index.version != version:
+            # Renders of the old version can no longer be hit
+            for entity in self.index.entities:
+                self.rendered.invalidate_containing(entity)
+
+        for misses in self._misses.values():
+            misses.clear()
+
     # ====================================================
     # Commands
 
@@ -121,11 +252,17 @@ class Compendium(commands.Cog):
             return await interaction.edit_original_response(
                 content='No results Founds.')
 
-        feat_model = Feat(record)
         return await interaction.edit_original_response(
-            embed=feat_model.embed, view=None
+            embeds=self.render_entity('feats', record, interaction.user),
+            view=None
         )
 
+    @feat.autocomplete('query')
+    async def feat_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return self.autocomplete_entity('feats', current)
+
     # ________________ Conditions _______________________
     @app_commands.command(name='condition')
     @app_commands.describe(query='Condition')
@@ -142,11 +279,17 @@ class Compendium(commands.Cog):
             return await interaction.edit_original_response(
                 content='No results Founds.')
 
-        condition_model = Condition(record)
         return await interaction.edit_original_response(
-            embed=condition_model.embed, view=None
+            embeds=self.render_entity('conditions', record, interaction.user),
+            view=None
         )
 
+    @condition.autocomplete('query')
+    async def condition_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return self.autocomplete_entity('conditions', current)
+
     # ________________ Maneuvers _______________________
     @app_commands.command(name='maneuver')
     @app_commands.describe(query='Maneuver')
@@ -163,12 +306,17 @@ class Compendium(commands.Cog):
             return await interaction.edit_original_response(
                 content='No results Founds.')
 
-        maneuver_model = Maneuver(record)
         return await interaction.edit_original_response(
-            embeds=maneuver_model.gen_embed(interaction.user),
+            embeds=self.render_entity('maneuvers', record, interaction.user),
             view=None
         )
 
+    @maneuver.autocomplete('query')
+    async def maneuver_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return self.autocomplete_entity('maneuvers', current)
+
     # ________________ Spells _______________________
     @app_commands.command(name='spell')
     @app_commands.describe(query='Spell')
@@ -185,51 +333,272 @@ class Compendium(commands.Cog):
             return await interaction.edit_original_response(
                 content='No results Founds.')
 
-        spell_model = Spell(record)
         return await interaction.edit_original_response(
-            embeds=spell_model.gen_embed(interaction.user),
+            embeds=self.render_entity('spells', record, interaction.user),
             view=None
         )
 
+    @spell.autocomplete('query')
+    async def spell_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return self.autocomplete_entity('spells', current)
+
+    # ________________ Any _______________________
+    @app_commands.command(name='lookup')
+    @app_commands.describe(query='Feat, condition, maneuver or spell')
+    async def lookup(
+        self,
+        interaction: discord.Interaction,
+        query: str
+    ):
+        """ Looks up any compendium entry. """
+        await interaction.response.defer()
+        result = await self.lookup_any(interaction, query)
+
+        if result is None:
+            return await interaction.edit_original_response(
+                content='No results Founds.')
+
+        entity, record = result
+        return await interaction.edit_original_response(
+            embeds=self.render_entity(entity, record, interaction.user),
+            view=None
+        )
+
+    @lookup.autocomplete('query')
+    async def lookup_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(name=name[:100], value=name[:100])
+            for name in self.index.complete_any(current)
+        ]
+
+    # ________________ Search _______________________
+    @app_commands.command(name='spells')
+    @app_commands.describe(
+        level='Spell level',
+        school='Primary school',
+        ritual='Only ritual spells',
+        concentration='Only concentration spells'
+    )
+    async def spells(
+        self,
+        interaction: discord.Interaction,
+        level: Optional[app_commands.Range[int, 0, 9]] = None,
+        school: Optional[SpellSchools] = None,
+        ritual: Optional[bool] = None,
+        concentration: Optional[bool] = None
+    ):
+        """ Lists spells matching the filters. """
+        filters = {
+            'level': level,
+            'primary_school': school.name if school else None,
+            'ritual': ritual,
+            'concentration': concentration,
+        }
+        rows = await self.filter_entity(
+            'spells', filters, ('level', 'name'), 'level, name')
+
+        entries = [f"{r['name']} *({ordinal(r['level'])})*" for r in rows]
+        await self.paginate(interaction, entries)
+
+    @app_commands.command(name='maneuvers')
+    @app_commands.describe(
+        tradition='Combat tradition',
+        degree='Maneuver degree',
+        exertion='Exertion cost'
+    )
+    async def maneuvers(
+        self,
+        interaction: discord.Interaction,
+        tradition: Optional[ManeuverTraditions] = None,
+        degree: Optional[app_commands.Range[int, 0, 5]] = None,
+        exertion: Optional[app_commands.Range[int, 0, 5]] = None
+    ):
+        """ Lists maneuvers matching the filters. """
+        filters = {
+            'tradition': tradition.name if tradition else None,
+            'degree': degree,
+            'exertion_cost': exertion,
+        }
+        rows = await self.filter_entity(
+            'maneuvers', filters, ('degree', 'name'), 'tradition, degree, name')
+
+        entries = [f"{r['name']} *({ordinal(r['degree'])} degree)*" for r in rows]
+        await self.paginate(interaction, entries)
+
+    @app_commands.command(name='search')
+    @app_commands.describe(query='What the entry does or says')
+    async def search(
+        self,
+        interaction: discord.Interaction,
+        query: str
+    ):
+        """ Searches the descriptions of every compendium entry. """
+        async with self.bot.pool.acquire() as conn:
+            rows: list[Record] = await PreparedStatements.fetch(conn, 'search', query)
+
+        entries = [
+            f"**{r['name']}** *({r['entity']})*\n{' '.join(r['snippet'].split())}"
+            for r in rows
+        ]
+        await self.paginate(interaction, entries, per_page=5)
+
     # ====================================================
     # Lookup Utils
+    def autocomplete_entity(
+        self, entity: str, current: str
+    ) -> list[app_commands.Choice[str]]:
+        """ Suggests names from the in-memory index. Never hits the database. """
+        return [
+            app_commands.Choice(name=name[:100], value=name[:100])
+            for name in self.index.complete(entity, current)
+        ]
+
+    async def filter_entity(
+        self,
+        entity: str,
+        filters: dict[str, Any],
+        columns: tuple[str, ...],
+        order: str
+    ) -> list[Record]:
+        """ Fetches the rows matching every filter that was given.
+
+        Only the given filters end up in the WHERE clause so the planner can
+        use the filter indexes instead of a catch-all generic plan.
+        """
+        clauses: list[str] = list()
+        args: list[Any] = list()
+
+        for column, value in filters.items():
+            if value is None:
+                continue
+
+            args.append(value)
+            clauses.append(f'{column} = ${len(args)}')
+
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        sql = f'SELECT {", ".join(columns)} FROM {entity} {where} ORDER BY {order}'
+
+        return await self.bot.pool.fetch(sql, *args)
+
+    async def paginate(
+        self, interaction: discord.Interaction, entries: list[str], per_page: int = 12
+    ) -> None:
+        if len(entries) == 0:
+            return await interaction.response.send_message('No results Founds.')
+
+        ctx: Context = await commands.Context.from_interaction(interaction)
+        pages = SimplePages(entries, ctx=ctx, per_page=per_page)
+        await pages.start()
+
     async def lookup_entity(
         self, interaction: discord.Interaction, entity: str, query: str
     ) -> Optional[Record]:
-        """ Looks up an entity in the database. """
+        """ Looks up an entity in memory, falling back to the database. """
 
-        conn = self.bot.pool
-        query = query.lower()
-
-        sql = f'''SELECT * FROM {entity} WHERE LOWER(name)=$1'''
-        row: Record = await conn.fetchrow(sql, query)
+        query = self.index.normalize(query)
 
+        # Exact hits are served from the in-memory index
+        row = self.index.get(entity, query)
         if row is not None:
             return row
 
-        # Perform Fuzzy Search
-        sql = f'''
-            SELECT      * 
-            FROM        {entity}
-            WHERE       name % $1
-            ORDER BY    similarity(name, $1) DESC
-            LIMIT       15
-            '''
+        if self.is_known_miss(entity, query):
+            return None
 
-        rows: list[Record] = await conn.fetch(sql, query)
+        # Perform exact and fuzzy search in one statement
+        async with self.bot.pool.acquire() as conn:
+            rows: list[Record] = await PreparedStatements.fetch(
+                conn, f'lookup_{entity}', query)
 
         # Return None if empty
         if rows is None or len(rows) == 0:
+            self.remember_miss(entity, query)
             return None
 
-        # Return first if only 1 found
-        if len(rows) == 1:
+        # Return first if it is an exact match or the only one found
+        if len(rows) == 1 or self.index.normalize(rows[0]['name']) == query:
             return rows[0]
 
+        value = await self.choose(interaction, [r['name'] for r in rows])
+        if value is None:
+            return None
+
+        for r in rows:
+            if r['name'] == value:
+                return r
+
+        return None
+
+    async def lookup_any(
+        self, interaction: discord.Interaction, query: str
+    ) -> Optional[tuple[str, Record]]:
+        """ Looks up a name across every entity in memory, falling back to a
+        single ranked query over every table. """
+
+        query = self.index.normalize(query)
+
+        matches = [(entity, row['name']) for entity, row in self.index.find(query)]
+        if len(matches) == 0 and self.is_known_miss('any', query):
+            return None
+
+        if len(matches) == 0:
+            async with self.bot.pool.acquire() as conn:
+                rows: list[Record] = await PreparedStatements.fetch(
+                    conn, 'lookup_any', query)
+
+            exact = [r for r in rows if self.index.normalize(r['name']) == query]
+            matches = [(r['entity'], r['name']) for r in (exact or rows)]
+
+        if len(matches) == 0:
+            self.remember_miss('any', query)
+            return None
+
+        if len(matches) == 1:
+            entity, name = matches[0]
+        else:
+            labels = {f'{name} ({entity})': (entity, name) for entity, name in matches}
+            value = await self.choose(interaction, list(labels))
+            if value is None:
+                return None
+
+            entity, name = labels[value]
+
+        record = self.index.get(entity, name)
+        if record is None:
+            record = await self.bot.pool.fetchrow(
+                f'SELECT {schema.columns[entity]} FROM {entity} WHERE name = $1', name)
+
+        return (entity, record) if record is not None else None
+
+    def miss_stats(self) -> list[tuple[str, int, int]]:
+        """ (entity, remembered misses, hits) for every entity. """
+        return [
+            (entity, len(misses), self.miss_hits[entity])
+            for entity, misses in self._misses.items()
+        ]
+
+    def is_known_miss(self, entity: str, query: str) -> bool:
+        if query in self._misses[entity]:
+            self.miss_hits[entity] += 1
+            return True
+
+        return False
+
+    def remember_miss(self, entity: str, query: str) -> None:
+        self._misses[entity][query] = True
+
+    async def choose(
+        self, interaction: discord.Interaction, choices: list[str]
+    ) -> Optional[str]:
+        """ Presents the choices and waits for the user to pick one. """
         ctx: Context = await commands.Context.from_interaction(interaction)
 
         # Present Choices
-        view = LookupView(interaction, rows)
+        view = LookupView(interaction, [{'name': c} for c in choices])
         view._embed.set_author(name=ctx.author.display_name)
 
         await interaction.edit_original_response(
@@ -237,15 +606,35 @@ class Compendium(commands.Cog):
         )
         await view.wait()
 
-        value = view.value
-        if value is None:
-            return None
+        return view.value
 
-        for r in rows:
-            if r['name'] == value:
-                return r
+    def render_entity(
+        self, entity: str, record: Record, author: discord.Member
+    ) -> list[discord.Embed]:
+        """ Renders a record with the embed of its model.
 
-        return None
+        Entries present in the index are rendered once per data version, only
+        the author header is applied per call.
+        """
+        model = models[entity]
+
+        if self.index.get(entity, record['name']) is not None:
+            embeds = self.rendered(entity, record['name'], self.index.version)
+        else:
+            embeds = model.load(record)
+
+        return model.decorate(embeds, author)
+
+    @cache.cache(
+        strategy=cache.Strategy.sized,
+        max_bytes=RENDER_MAX_BYTES,
+        key_mode=cache.KeyMode.tuple,
+        persist=256,
+        tags=lambda self, entity, name, version: (entity, f'{entity}:{CompendiumIndex.normalize(name)}')
+    )
+    def rendered(self, entity: str, name: str, version: str) -> list[discord.Embed]:
+        """ Author independent embeds of an indexed entry. """
+        return models[entity].load(self.index.get(entity, name))
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                         Setup
@@ -26,6 +26,8 @@ from discord.ext import commands
 
 # Local application imports
 import main.cogs.utils.formats as formats
+from main.cogs.utils import cache
+from main.cogs.utils.db import PreparedStatements
 from main.cogs.utils.formats import TabularData, Plural
 
 
@@ -219,6 +221,52 @@ class Owner(commands.Cog):
         else:
             await ctx.send(fmt)
 
+    @commands.command(hidden=True)
+    async def statements(self, ctx: Context):
+        """Shows usage of the prepared statements."""
+        table = TabularData()
+        table.set_columns(['Statement', 'Uses', 'Connections'])
+        table.add_rows(
+            [name, PreparedStatements.usage[name], PreparedStatements.connections(name)]
+            for name in PreparedStatements.queries
+        )
+
+        await ctx.send(f'```\n{table.render()}\n```')
+
+    @commands.command(hidden=True)
+    async def misses(self, ctx: Context):
+        """Shows how many lookups the negative cache absorbed."""
+        cog = self.bot.get_cog('Compendium')
+        if cog is None:
+            return await ctx.send('Compendium is not loaded.')
+
+        table = TabularData()
+        table.set_columns(['Entity', 'Remembered', 'Hits'])
+        table.add_rows(cog.miss_stats())
+
+        await ctx.send(f'```\n{table.render()}\n```')
+
+    @commands.command(hidden=True)
+    async def caches(self, ctx: Context):
+        """Shows the counters of every cache."""
+        table = TabularData()
+        table.set_columns(['Cache', 'Strategy', 'Size', 'Bytes', 'Hits', 'Misses', 'Evictions', 'Avg Load'])
+        table.add_rows(
+            [
+                stats.name,
+                stats.strategy.name,
+                stats.size,
+                '-' if stats.nbytes is None else stats.nbytes,
+                stats.hits,
+                stats.misses,
+                stats.evictions,
+                f'{stats.average_load * 1000:.2f}ms',
+            ]
+            for stats in sorted(cache.registry.values(), key=lambda s: s.name)
+        )
+
+        await ctx.send(f'```\n{table.render()}\n```')
+
     @commands.command(hidden=True, name='eval')
     async def _eval(self, ctx: Context, *, body: str) -> None:
         """ Evaluates code """
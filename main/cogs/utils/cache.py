@@ -8,15 +8,20 @@ import asyncio
 import enum
 import inspect
 import logging
+import os
+import pickle
+import sys
 import time
 
-from functools import wraps
-from typing import Any, Awaitable, Callable, Coroutine, MutableMapping, Protocol, TypeVar
+from collections import OrderedDict
+from functools import partial, wraps
+from typing import Any, Callable, Coroutine, Iterable, MutableMapping, Optional, Protocol, TypeVar
 
 # Third party imports
 from lru import LRU
 
 
+import discord
 from discord.ext import commands
 
 
@@ -32,6 +37,7 @@ log = logging.getLogger(__name__)
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 class CacheProtocol(Protocol[R]):
     cache: MutableMapping[str, R]
+    stats: CacheStats
 
     def __call__(self, *args: Any, **kwds: Any) -> R:
         ...
@@ -45,21 +51,10 @@ class CacheProtocol(Protocol[R]):
     def invalidate_containing(self, key: str) -> None:
         ...
 
-    def get_status(self) -> tuple[int, int]:
+    def get_stats(self) -> tuple[int, int]:
         ...
 
 
-def _wrap_and_store_coroutine(
-    cache: MutableMapping[str, R], key: str, coro: Awaitable[R]
-) -> Coroutine[Any, Any, R]:
-    async def func():
-        value = await coro
-        cache[key] = value
-        return value
-
-    return func()
-
-
 def _wrap_new_coroutine(value: R) -> Coroutine[Any, Any, R]:
     async def new_coroutine():
         return value
@@ -67,32 +62,224 @@ def _wrap_new_coroutine(value: R) -> Coroutine[Any, Any, R]:
     return new_coroutine()
 
 
+def _wrap_shared_task(task: asyncio.Task[R]) -> Coroutine[Any, Any, R]:
+    async def func():
+        # Shielded so one cancelled waiter does not cancel the shared load
+        return await asyncio.shield(task)
+
+    return func()
+
+
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                      Expiring Cache
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-class ExpiringCache(dict):
-    def __init__(self, seconds: float) -> None:
+class ExpiringCache(OrderedDict):
+    """ Dict whose entries expire `seconds` after they were last set.
+
+    Every entry lives for the same ttl, so insertion order is expiry order.
+    Expired entries are always at the front and are dropped lazily in
+    amortized O(1). With `maxsize` the oldest entries are evicted first, and
+    `callback(key, value)` is called for every expired or evicted entry.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        maxsize: Optional[int] = None,
+        callback: Optional[Callable[[Any, Any], None]] = None
+    ) -> None:
         self.__ttl: float = seconds
+        self.__maxsize: Optional[int] = maxsize
+        self.__callback = callback
+        self.__expiry: dict[Any, float] = {}
         super().__init__()
 
+    def __evict(self, key: Any) -> None:
+        value = super().__getitem__(key)
+        super().__delitem__(key)
+        del self.__expiry[key]
+
+        if self.__callback is not None:
+            self.__callback(key, value)
+
     def __verify_cache_integrity(self) -> None:
         current_time: float = time.monotonic()
-        to_remove = [k for (k, (v, t)) in self.items()
-                     if current_time > (t + self.__ttl)]
-        for k in to_remove:
-            del self[k]
+        while self:
+            key = next(iter(self))
+            if self.__expiry[key] > current_time:
+                break
+
+            self.__evict(key)
 
-    def __contains__(self, key: str) -> bool:
+    def __contains__(self, key: Any) -> bool:
         self.__verify_cache_integrity()
         return super().__contains__(key)
 
-    def __getitem__(self, key: str) -> Any:
+    def __getitem__(self, key: Any) -> Any:
         self.__verify_cache_integrity()
         return super().__getitem__(key)
 
-    def __setitem__(self, key: str, value: Any) -> None:
+    def __setitem__(self, key: Any, value: Any) -> None:
         self.__verify_cache_integrity()
+        if super().__contains__(key):
+            self.move_to_end(key)
+
+        super().__setitem__(key, value)
+        self.__expiry[key] = time.monotonic() + self.__ttl
+
+        if self.__maxsize is not None:
+            while len(self) > self.__maxsize:
+                self.__evict(next(iter(self)))
+
+    def __delitem__(self, key: Any) -> None:
+        super().__delitem__(key)
+        del self.__expiry[key]
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self) -> None:
+        super().clear()
+        self.__expiry.clear()
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                        Sized Cache
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+def approximate_size(value: Any) -> int:
+    """ Rough number of bytes held by a cached value. """
+    if isinstance(value, discord.Embed):
+        value = value.to_dict()
+
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            approximate_size(k) + approximate_size(v) for k, v in value.items())
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(approximate_size(v) for v in value)
+
+    # asyncpg records and other mappings of columns
+    if hasattr(value, 'items') and hasattr(value, 'keys'):
+        return sys.getsizeof(value) + sum(approximate_size(v) for v in value.values())
+
+    return sys.getsizeof(value)
+
+
+class SizedCache(OrderedDict):
+    """ LRU dict holding at most `max_bytes` worth of values.
+
+    Values are measured once with `sizeof` when they are set. Least recently
+    used entries are evicted until the total fits again, and values larger
+    than the whole budget are not stored. `callback(key, value)` is called
+    for every evicted entry.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        sizeof: Callable[[Any], int] = approximate_size,
+        callback: Optional[Callable[[Any, Any], None]] = None
+    ) -> None:
+        self.max_bytes: int = max_bytes
+        self.nbytes: int = 0
+        self.__sizeof = sizeof
+        self.__callback = callback
+        self.__sizes: dict[Any, int] = {}
+        super().__init__()
+
+    def __evict(self, key: Any) -> None:
+        value = super().__getitem__(key)
+        del self[key]
+
+        if self.__callback is not None:
+            self.__callback(key, value)
+
+    def __getitem__(self, key: Any) -> Any:
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        size = self.__sizeof(value)
+        if super().__contains__(key):
+            del self[key]
+
+        if size > self.max_bytes:
+            log.debug(f'Not caching {key}, {size} bytes is over the budget.')
+            return
+
         super().__setitem__(key, value)
+        self.__sizes[key] = size
+        self.nbytes += size
+
+        while self.nbytes > self.max_bytes:
+            self.__evict(next(iter(self)))
+
+    def __delitem__(self, key: Any) -> None:
+        super().__delitem__(key)
+        self.nbytes -= self.__sizes.pop(key)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self) -> None:
+        super().clear()
+        self.__sizes.clear()
+        self.nbytes = 0
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                       Cache Stats
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class CacheStats:
+    """ Counters of a single cache created through `cache()`. """
+    __slots__ = ('name', 'strategy', 'hits', 'misses', 'evictions', 'loads', 'load_time', '_cache')
+
+    def __init__(self, name: str, strategy: Strategy, cache: MutableMapping[Any, Any]) -> None:
+        self.name: str = name
+        self.strategy: Strategy = strategy
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.loads: int = 0
+        # Seconds spent running the wrapped function
+        self.load_time: float = 0.0
+        self._cache: MutableMapping[Any, Any] = cache
+
+    @property
+    def size(self) -> int:
+        return len(self._cache)
+
+    @property
+    def nbytes(self) -> Optional[int]:
+        """ Measured size of the values, only tracked by `Strategy.sized`. """
+        return getattr(self._cache, 'nbytes', None)
+
+    @property
+    def average_load(self) -> float:
+        """ Average seconds per call of the wrapped function. """
+        return self.load_time / self.loads if self.loads else 0.0
+
+    def record_load(self, started: float) -> None:
+        self.loads += 1
+        self.load_time += time.perf_counter() - started
+
+
+# Every cache created through `cache()`, by qualified function name
+registry: dict[str, CacheStats] = {}
+
+
+# Caches created with `persist`, by qualified function name
+persistent: dict[str, CacheProtocol] = {}
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -102,6 +289,12 @@ class Strategy(enum.Enum):
     lru = 1
     raw = 2
     timed = 3
+    sized = 4
+
+
+class KeyMode(enum.Enum):
+    string = 1
+    tuple = 2
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -110,29 +303,117 @@ class Strategy(enum.Enum):
 def cache(
     maxsize: int = 128,
     strategy: Strategy = Strategy.lru,
-    ignore_kwargs: bool = False
+    ignore_kwargs: bool = False,
+    stale_after: Optional[float] = None,
+    ttl: Optional[float] = None,
+    key_mode: KeyMode = KeyMode.string,
+    tags: Optional[Callable[..., Iterable[str]]] = None,
+    max_bytes: Optional[int] = None,
+    sizeof: Callable[[Any], int] = approximate_size,
+    persist: int = 0
 ) -> Callable[[Callable[..., R]], CacheProtocol[R]]:
+    """ Caches the results of a function.
+
+    `Strategy.timed` expires entries after `ttl` seconds and holds at most
+    `maxsize` of them. Without `ttl`, `maxsize` is the ttl and the cache is
+    unbounded.
+
+    `Strategy.sized` is an LRU bounded by `max_bytes`, measured per value
+    with `sizeof` instead of counting entries.
+
+    Coroutine functions share a single in-flight call per key, so concurrent
+    misses only run the coroutine once. A failed call hands its exception to
+    every waiter and stores nothing. With `stale_after`, hits older than that
+    many seconds are still served while one refresh runs in the background.
+
+    `KeyMode.tuple` keys entries by a tuple of the arguments instead of their
+    joined reprs, which is cheaper to build and compares arguments by
+    equality. Calls with unhashable arguments fall back to string keys.
+
+    `tags` is called with the same arguments as the function and returns the
+    tags of the entry, e.g. its table and name. `invalidate_containing` with
+    a known tag only removes the entries carrying it, instead of scanning
+    every key.
+
+    With `persist`, up to that many of the most recently used entries are
+    written by `save_snapshot` and restored by `load_snapshot`. Keys and
+    values must be picklable.
+
+    Every cache registers its `CacheStats` in `registry` under the qualified
+    name of the function.
+    """
 
     def decorator(func: Callable[..., R]) -> CacheProtocol[R]:
+        _stored_at: dict[str, float] = {}
+        _inflight: dict[str, asyncio.Task] = {}
+        _is_coroutine = asyncio.iscoroutinefunction(func)
+
+        # tag -> keys and key -> tags, kept in step with the cache
+        _tagged: dict[str, set] = {}
+        _key_tags: dict[Any, tuple[str, ...]] = {}
+
+        def _tag(key: Any, args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+            if tags is not None:
+                _register_tags(key, tuple(tags(*args, **kwargs)))
+
+        def _register_tags(key: Any, entry_tags: tuple[str, ...]) -> None:
+            _untag(key)
+            if not entry_tags:
+                return
+
+            _key_tags[key] = entry_tags
+            for tag in entry_tags:
+                _tagged.setdefault(tag, set()).add(key)
+
+        def _untag(key: Any) -> None:
+            for tag in _key_tags.pop(key, ()):
+                keys = _tagged.get(tag)
+                if keys is None:
+                    continue
+
+                keys.discard(key)
+                if not keys:
+                    del _tagged[tag]
+
+        def _evicted(key: str, value: Any) -> None:
+            _stored_at.pop(key, None)
+            _untag(key)
+            _stats.evictions += 1
+
         if strategy is Strategy.lru:
-            _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
+            _internal_cache = LRU(maxsize, callback=_evicted)
         elif strategy is Strategy.raw:
             _internal_cache = {}
-            def _stats(): return (0, 0)
         elif strategy is Strategy.timed:
-            _internal_cache = ExpiringCache(maxsize)
-            def _stats(): return (0, 0)
-
-        def _make_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
-            # this is a bit of a cluster fuck
-            # we do care what 'self' parameter is when we __repr__ it
-            def _true_repr(o):
-                if o.__class__.__repr__ is object.__repr__:
-                    return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
-                return repr(o)
-
-            key = [f'{func.__module__}.{func.__name__}']
+            if ttl is None:
+                _internal_cache = ExpiringCache(maxsize, callback=_evicted)
+            else:
+                _internal_cache = ExpiringCache(ttl, maxsize, callback=_evicted)
+        elif strategy is Strategy.sized:
+            if max_bytes is None:
+                raise ValueError('Strategy.sized requires max_bytes.')
+            _internal_cache = SizedCache(max_bytes, sizeof, callback=_evicted)
+
+        _name = f'{func.__module__}.{func.__qualname__}'
+        _stats = registry[_name] = CacheStats(_name, strategy, _internal_cache)
+
+        # this is a bit of a cluster fuck
+        # we do care what 'self' parameter is when we __repr__ it
+        def _true_repr(o):
+            if o.__class__.__repr__ is object.__repr__:
+                return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
+            return repr(o)
+
+        def _true_key(o):
+            # Paired with the type so 1, 1.0 and True stay apart like their
+            # reprs do. Same bypass as above, instances with the default repr
+            # only count by their class
+            if o.__class__.__repr__ is object.__repr__:
+                return (o.__class__, o.__class__)
+            return (o.__class__, o)
+
+        def _make_str_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+            key = [_name]
             key.extend(_true_repr(o) for o in args)
             if not ignore_kwargs:
                 for k, v in kwargs.items():
@@ -148,48 +429,255 @@ def cache(
 
             return ':'.join(key)
 
+        def _make_tuple_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+            key = (_name, *map(_true_key, args))
+            if kwargs and not ignore_kwargs:
+                key += tuple(
+                    (k, *_true_key(v)) for k, v in kwargs.items() if k != 'connection'
+                )
+
+            try:
+                hash(key)
+            except TypeError:
+                return _make_str_key(args, kwargs)
+
+            return key
+
+        _make_key = _make_tuple_key if key_mode is KeyMode.tuple else _make_str_key
+
+        def _part_str(part: tuple[Any, ...]) -> str:
+            *kwarg, cls, value = part
+            if value is cls:
+                value = f'<{cls.__module__}.{cls.__name__}>'
+            else:
+                value = _true_repr(value)
+            return ':'.join([*map(_true_repr, kwarg), value])
+
+        def _key_str(key: Any) -> str:
+            if isinstance(key, str):
+                return key
+            return ':'.join([key[0], *map(_part_str, key[1:])])
+
+        def _set(key: Any, value: Any) -> bool:
+            """ Stores the value, False when the cache refused it. """
+            _internal_cache[key] = value
+            if key in _internal_cache:
+                return True
+
+            # Sized caches drop values over their budget, with any older entry
+            _stored_at.pop(key, None)
+            _untag(key)
+            return False
+
+        def _put(key: Any, value: Any, args: tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+            if _set(key, value):
+                _stored_at[key] = time.monotonic()
+                _tag(key, args, kwargs)
+
+        def _store(
+            key: str,
+            args: tuple[Any, ...],
+            kwargs: dict[str, Any],
+            started: float,
+            task: asyncio.Task
+        ) -> None:
+            if not task.cancelled():
+                _stats.record_load(started)
+
+            # Invalidated while loading, hand the result to waiters only
+            if _inflight.get(key) is not task:
+                return
+
+            del _inflight[key]
+            if task.cancelled():
+                return
+
+            if task.exception() is not None:
+                log.debug(f'Not caching failed call {key}.')
+                return
+
+            _put(key, task.result(), args, kwargs)
+
+        def _load(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> asyncio.Task:
+            task = _inflight.get(key)
+            if task is None:
+                task = _inflight[key] = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(partial(_store, key, args, kwargs, time.perf_counter()))
+
+            return task
+
+        async def _wrap_and_store_coroutine(
+            key: str, args: tuple[Any, ...], kwargs: dict[str, Any], coro: Any, started: float
+        ) -> R:
+            value = await coro
+            _stats.record_load(started)
+            _put(key, value, args, kwargs)
+            return value
+
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> None:
             key = _make_key(args, kwargs)
             try:
                 value = _internal_cache[key]
             except KeyError:
+                _stats.misses += 1
+                if _is_coroutine:
+                    return _wrap_shared_task(_load(key, args, kwargs))
+
+                started = time.perf_counter()
                 value = func(*args, **kwargs)
 
                 if inspect.isawaitable(value):
-                    return _wrap_and_store_coroutine(_internal_cache, key, value)
+                    return _wrap_and_store_coroutine(key, args, kwargs, value, started)
 
-                _internal_cache[key] = value
+                _stats.record_load(started)
+                _put(key, value, args, kwargs)
                 return value
             else:
-                if asyncio.iscoroutinefunction(func):
+                _stats.hits += 1
+                if _is_coroutine:
+                    age = time.monotonic() - _stored_at.get(key, 0.0)
+                    if stale_after is not None and age > stale_after:
+                        _load(key, args, kwargs)
+
                     return _wrap_new_coroutine(value)
                 return value
 
+        def _forget(key: str) -> None:
+            _stored_at.pop(key, None)
+            _inflight.pop(key, None)
+            _untag(key)
+
         def _invalidate(*args: Any, **kwargs: Any) -> bool:
+            key = _make_key(args, kwargs)
+            _forget(key)
             try:
-                del _internal_cache[_make_key(args, kwargs)]
+                del _internal_cache[key]
             except KeyError:
                 return False
             else:
                 return True
 
         def _invalidate_containing(key: str) -> None:
-            to_remove = []
-            for k in _internal_cache.keys():
-                if key in k:
-                    to_remove.append(k)
+            if key in _tagged:
+                to_remove = list(_tagged[key])
+            else:
+                to_remove = [k for k in _internal_cache.keys() if key in _key_str(k)]
+
+            # Calls still loading are not tagged yet
+            to_remove.extend(k for k in _inflight if key in _key_str(k))
+
             for k in to_remove:
+                _forget(k)
                 try:
                     del _internal_cache[k]
                 except KeyError:
                     continue
 
+        def _recent_keys() -> list[Any]:
+            # LRU iterates most recent first, the dicts most recent last
+            if isinstance(_internal_cache, LRU):
+                return list(_internal_cache.keys())
+            return list(reversed(_internal_cache.keys()))
+
+        def _snapshot() -> list[tuple[Any, Any, tuple[str, ...]]]:
+            entries = []
+            for key in _recent_keys()[:persist]:
+                try:
+                    value = _internal_cache[key]
+                except KeyError:
+                    continue
+                entries.append((key, value, _key_tags.get(key, ())))
+
+            # Oldest first, so restoring keeps the recency order
+            entries.reverse()
+            return entries
+
+        def _restore(entries: list[tuple[Any, Any, tuple[str, ...]]]) -> None:
+            now = time.monotonic()
+            for key, value, entry_tags in entries:
+                if _set(key, value):
+                    _stored_at[key] = now
+                    _register_tags(key, entry_tags)
+
+        if persist:
+            wrapper.snapshot = _snapshot
+            wrapper.restore = _restore
+            persistent[_name] = wrapper
+
         wrapper.cache = _internal_cache
         wrapper.get_key = lambda *args, **kwargs: _make_key(args, kwargs)
         wrapper.invalidate = _invalidate
-        wrapper.get_stats = _stats
+        wrapper.get_stats = lambda: (_stats.hits, _stats.misses)
+        wrapper.stats = _stats
         wrapper.invalidate_containing = _invalidate_containing
         return wrapper
 
     return decorator
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                        Snapshots
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+def save_snapshot(path: str, version: str) -> int:
+    """ Writes the hottest entries of every persistent cache to `path`.
+
+    Returns the number of entries written.
+    """
+    caches: dict[str, bytes] = {}
+    total = 0
+    for name, func in persistent.items():
+        entries = func.snapshot()
+        try:
+            caches[name] = pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            log.warning(f'Could not snapshot cache {name}.', exc_info=True)
+            continue
+        total += len(entries)
+
+    # Written aside first so a crash never leaves half a snapshot behind
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as fp:
+        pickle.dump({'version': version, 'caches': caches}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+
+    log.info(f'Saved {total} cache entries to {path}.')
+    return total
+
+
+def load_snapshot(path: str, version: str) -> int:
+    """ Restores the persistent caches from `path`.
+
+    The snapshot is discarded when it was taken for another `version`.
+    Returns the number of entries restored.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            snapshot = pickle.load(fp)
+    except FileNotFoundError:
+        return 0
+    except Exception:
+        log.warning(f'Could not read cache snapshot {path}.', exc_info=True)
+        return 0
+
+    if snapshot.get('version') != version:
+        log.info(f'Discarding cache snapshot {path} of another version.')
+        return 0
+
+    total = 0
+    for name, data in snapshot['caches'].items():
+        func = persistent.get(name)
+        if func is None:
+            continue
+
+        try:
+            entries = pickle.loads(data)
+        except Exception:
+            log.warning(f'Could not restore cache {name}.', exc_info=True)
+            continue
+
+        func.restore(entries)
+        total += len(entries)
+
+    log.info(f'Restored {total} cache entries from {path}.')
+    return total
@@ -9,7 +9,10 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
-from typing import TYPE_CHECKING, Optional
+import os
+import re
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Optional
 
 # Third party imports
 import asyncpg
@@ -18,13 +21,25 @@ import asyncpg
 # Local application imports
 from main.settings import schema
 
+# Try Import
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 if TYPE_CHECKING:
+    from asyncpg import Record
+    from asyncpg.prepared_stmt import PreparedStatement
     from typing_extensions import Self
 
 
 log = logging.getLogger(__name__)
 
+# Advisory lock key held while migrating
+MIGRATION_LOCK = 0x5A454E
+MIGRATION_LOCK_POLL = 0.5
+
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                           Error
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -34,6 +49,45 @@ class SchemaError(Exception):
     pass
 
 
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                         Migration
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class Migration:
+    """ A single migration file named `<version>_<name>.sql`.
+
+    Files starting with a `-- no-transaction` line are run one statement at a
+    time outside a transaction, which `CREATE INDEX CONCURRENTLY` requires.
+    Such migrations must be idempotent since a failure part way through
+    leaves the earlier statements applied. Invalid indexes left by a failed
+    concurrent build are dropped before they are retried. Such files are
+    split into statements on a `;` at the end of a line, so they cannot
+    contain `DO $$` blocks or other bodies spanning several statements.
+    """
+    __slots__ = ('version', 'name', 'path')
+
+    def __init__(self, path: str) -> None:
+        version, _, name = os.path.basename(path)[:-4].partition('_')
+        self.version: int = int(version)
+        self.name: str = name
+        self.path: str = path
+
+    def read(self) -> str:
+        with open(self.path, 'r', encoding='utf8') as reader:
+            return reader.read()
+
+    @property
+    def transactional(self) -> bool:
+        return not self.read().startswith('-- no-transaction')
+
+    @property
+    def statements(self) -> list[str]:
+        sql = self.read()
+        return [s.strip() for s in re.split(r';\s*(?:\n|$)', sql) if s.strip()]
+
+    def __repr__(self) -> str:
+        return f'<Migration version={self.version} name={self.name!r}>'
+
+
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #                         Maybe Acquire
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -55,34 +109,107 @@ class MaybeAcquire:
             await self.pool.release(self._connection)
 
 
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                    Prepared Statements
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class PreparedStatements:
+    """ Registry of named statements prepared on every pool connection.
+
+    Statements are keyed by the backend pid of the connection they were
+    prepared on, since pool proxies do not outlive a single acquire. Entries
+    are dropped once their connection closes, e.g. when the pool recycles it.
+    """
+    queries: dict[str, str] = dict(schema.statements)
+    usage: Counter[str] = Counter()
+    _prepared: dict[int, dict[str, PreparedStatement]] = dict()
+
+    @classmethod
+    async def warmup(cls, conn) -> None:
+        """ Prepares every registered statement on a fresh connection. """
+        pid = conn.get_server_pid()
+        prepared = cls._prepared[pid] = dict()
+        conn.add_termination_listener(lambda _: cls.forget(pid))
+
+        for name, query in cls.queries.items():
+            try:
+                prepared[name] = await conn.prepare(query)
+            except (asyncpg.UndefinedTableError, asyncpg.UndefinedColumnError, asyncpg.UndefinedFunctionError):
+                # Schema not created yet, prepare lazily on first use.
+                log.info(f'Skipping warmup of statement {name}.')
+
+    @classmethod
+    def forget(cls, pid: int) -> None:
+        cls._prepared.pop(pid, None)
+
+    @classmethod
+    async def get(cls, conn, name: str) -> PreparedStatement:
+        prepared = cls._prepared.setdefault(conn.get_server_pid(), dict())
+
+        stmt = prepared.get(name)
+        if stmt is None:
+            stmt = prepared[name] = await conn.prepare(cls.queries[name])
+
+        return stmt
+
+    @classmethod
+    async def fetch(cls, conn, name: str, *args: Any) -> list[Record]:
+        """ Runs a registered statement on the given connection. """
+        cls.usage[name] += 1
+        stmt = await cls.get(conn, name)
+
+        try:
+            return await stmt.fetch(*args)
+        except asyncpg.InvalidCachedStatementError:
+            # Table changed under us, prepare again and retry once.
+            del cls._prepared[conn.get_server_pid()][name]
+            stmt = await cls.get(conn, name)
+            return await stmt.fetch(*args)
+
+    @classmethod
+    def connections(cls, name: str) -> int:
+        """ Number of connections the statement is prepared on. """
+        return sum(name in p for p in cls._prepared.values())
+
+
 # --------------------------------------------------------------------------
 #                                    DB Class
 # --------------------------------------------------------------------------
 class DB:
     @classmethod
     async def create_pool(cls, uri: str, **kwargs):
-        def _encode_jsonb(value):
-            return json.dumps(value)
-
-        def _decode_jsonb(value):
-            return json.loads(value)
+        # Decoding happens once per row inside the driver, models receive
+        # plain python objects.
+        if orjson is not None:
+            def _encode_jsonb(value):
+                return orjson.dumps(value).decode('utf-8')
+
+            _decode_jsonb = orjson.loads
+        else:
+            def _encode_jsonb(value):
+                return json.dumps(value)
+
+            _decode_jsonb = json.loads
+
+        # Before the pool, its connections prepare statements against the
+        # migrated schema. Failures are raised, a half migrated database is
+        # not usable.
+        conn = await asyncpg.connect(uri)
+        try:
+            await cls.migrate(conn)
+        finally:
+            await conn.close()
 
         old_init = kwargs.pop('init', None)
 
         async def init(conn):
             await conn.set_type_codec('jsonb', schema='pg_catalog', encoder=_encode_jsonb, decoder=_decode_jsonb, format='text')
+            await PreparedStatements.warmup(conn)
             if old_init is not None:
                 await old_init(conn)
 
         cls._pool = pool = await asyncpg.create_pool(uri, init=init, **kwargs)
         log.info('Connected to db and acquired pool.')
 
-        # Do db stuff
-        try:
-            await cls.create_schemas(pool)
-        except Exception as e:
-            print(e)
-
         return pool
 
     @classmethod
@@ -95,7 +222,7 @@ class DB:
         # Extension
         await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
 
-        sql_queries: dict = schema.tables
+        sql_queries: dict = schema.baseline
         ct: str = "CREATE TABLE IF NOT EXISTS"
 
         # Optionally create tables
@@ -103,20 +230,133 @@ class DB:
             sql: str = f"{ct} {table}({query})"
             await conn.execute(sql)
 
-        # TODO: Optionally create indexes
+        # Create indexes
         sql_indexes = schema.indexes
         for index in sql_indexes:
             await conn.execute(index)
 
+    # Index checks
+    @classmethod
+    async def check_indexes(cls, pool, sample: str = 'fireball') -> dict[str, bool]:
+        """ Explains every registered statement and reports whether it avoids
+        sequential scans. Seq scans are disabled for the check so tiny tables
+        do not hide a missing index. """
+        results: dict[str, bool] = dict()
+
+        async with pool.acquire() as con:
+            for name, query in schema.statements.items():
+                async with con.transaction():
+                    await con.execute('SET LOCAL enable_seqscan = off')
+                    plan = await con.fetchval(f'EXPLAIN (FORMAT JSON) {query}', sample)
+
+                nodes = [json.loads(plan)[0]['Plan']]
+                uses_index = True
+                while nodes:
+                    node = nodes.pop()
+                    if node['Node Type'] == 'Seq Scan':
+                        uses_index = False
+                    nodes.extend(node.get('Plans', []))
+
+                results[name] = uses_index
+                if not uses_index:
+                    log.warning(f'Statement {name} does not use an index.')
+
+        return results
+
     # Get Migrations.
     @classmethod
-    def get_migrations(cls):
-        pass
+    def get_migrations(cls) -> list[Migration]:
+        """ Returns the migration files ordered by version. """
+        files = [f for f in os.listdir(schema.migrations) if f.endswith('.sql')]
+        migrations = [Migration(os.path.join(schema.migrations, f)) for f in files]
+        migrations.sort(key=lambda m: m.version)
+
+        versions = [m.version for m in migrations]
+        if len(versions) != len(set(versions)):
+            raise SchemaError(f'Duplicate migration versions in {schema.migrations}.')
+
+        return migrations
+
+    @classmethod
+    async def get_version(cls, conn) -> Optional[int]:
+        """ Returns the recorded schema version, None for a new database. """
+        try:
+            return await conn.fetchval('SELECT MAX(version) FROM schema_version')
+        except asyncpg.UndefinedTableError:
+            return None
+
+    @classmethod
+    async def drop_invalid_indexes(cls, conn) -> None:
+        """ Drops indexes left invalid by a failed concurrent build. """
+        invalid = await conn.fetch('''
+            SELECT      c.relname
+            FROM        pg_index i
+            JOIN        pg_class c ON c.oid = i.indexrelid
+            JOIN        pg_namespace n ON n.oid = c.relnamespace
+            WHERE       NOT i.indisvalid AND n.nspname = current_schema()
+        ''')
+
+        for index in invalid:
+            log.warning(f'Dropping invalid index {index["relname"]}.')
+            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index["relname"]}"')
 
     # Migrate if needed.
     @classmethod
-    def migrate(cls, conn):
-        pass
+    async def migrate(cls, conn) -> None:
+        """ Brings the database up to the latest migration.
+
+        Version 0 is the frozen `schema.baseline`, every migration is replayed
+        on top of it. Nothing is executed when the recorded version is already
+        current. Concurrent callers wait on an advisory lock, so only one of
+        them applies the migrations.
+        """
+        migrations = cls.get_migrations()
+        latest = migrations[-1].version if migrations else 0
+
+        # Polled rather than blocking in pg_advisory_lock, a blocked statement
+        # holds a snapshot that CREATE INDEX CONCURRENTLY would wait on
+        while not await conn.fetchval('SELECT pg_try_advisory_lock($1)', MIGRATION_LOCK):
+            log.info('Waiting for another process to finish migrating.')
+            await asyncio.sleep(MIGRATION_LOCK_POLL)
+
+        try:
+            current = await cls.get_version(conn)
+
+            if current is not None and current >= latest:
+                log.info(f'Schema is up to date at version {current}.')
+                return
+
+            if current is None:
+                await cls.create_schemas(conn)
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_version(
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+                    )
+                ''')
+                await conn.execute(
+                    'INSERT INTO schema_version(version, name) VALUES(0, $1) ON CONFLICT DO NOTHING',
+                    'baseline')
+                current = 0
+
+            record = 'INSERT INTO schema_version(version, name) VALUES($1, $2)'
+            for migration in migrations:
+                if migration.version <= current:
+                    continue
+
+                log.info(f'Applying migration {migration}.')
+                if migration.transactional:
+                    async with conn.transaction():
+                        await conn.execute(migration.read())
+                        await conn.execute(record, migration.version, migration.name)
+                else:
+                    await cls.drop_invalid_indexes(conn)
+                    for statement in migration.statements:
+                        await conn.execute(statement)
+                    await conn.execute(record, migration.version, migration.name)
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK)
 
     # Data integrity checks.
     # Log information
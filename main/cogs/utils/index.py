@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                         Imports
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+from __future__ import annotations
+
+# Standard library imports
+import hashlib
+import logging
+
+from typing import TYPE_CHECKING, Iterable, Optional
+
+# Third party imports
+
+
+# Local application imports
+from main.settings import schema
+
+
+if TYPE_CHECKING:
+    from asyncpg import Pool, Record
+
+
+log = logging.getLogger(__name__)
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                        Prefix Trie
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class PrefixTrie:
+    """ Trie of normalized names.
+
+    Every node keeps the first `limit` names below it, so a prefix lookup
+    only walks the prefix itself.
+    """
+    __slots__ = ('limit', '_root', '_names')
+
+    def __init__(self, names: Iterable[str], *, limit: int = 25) -> None:
+        self.limit: int = limit
+        self._root: dict = {'': []}
+        self._names: list[tuple[str, str]] = sorted(
+            (CompendiumIndex.normalize(n), n) for n in names)
+
+        for key, name in self._names:
+            node = self._root
+            self._add(node, name)
+            for char in key:
+                node = node.setdefault(char, {'': []})
+                self._add(node, name)
+
+    def _add(self, node: dict, name: str) -> None:
+        if len(node['']) < self.limit:
+            node[''].append(name)
+
+    def search(self, query: str) -> list[str]:
+        """ Returns names starting with the query, then names containing it. """
+        query = CompendiumIndex.normalize(query)
+
+        node = self._root
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                results = []
+                break
+        else:
+            results = list(node[''])
+
+        if len(results) >= self.limit or not query:
+            return results
+
+        # Infix fallback
+        for key, name in self._names:
+            if query in key and not key.startswith(query):
+                results.append(name)
+                if len(results) >= self.limit:
+                    break
+
+        return results
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#                     Compendium Index
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+class CompendiumIndex:
+    """ In-memory copy of the compendium tables keyed by normalized name. """
+
+    def __init__(self, entities: Iterable[str]) -> None:
+        self.entities: tuple[str, ...] = tuple(entities)
+        # Digest of the loaded rows, stable across restarts
+        self.version: str = ''
+        self._entries: dict[str, dict[str, Record]] = {
+            entity: dict() for entity in self.entities
+        }
+        self._tries: dict[str, PrefixTrie] = {
+            entity: PrefixTrie([]) for entity in self.entities
+        }
+
+        # Unified view over every entity
+        self._names: dict[str, list[tuple[str, Record]]] = dict()
+        self._all: PrefixTrie = PrefixTrie([])
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return name.strip().lower()
+
+    async def load(self, pool: Pool) -> None:
+        """ Loads every entity table into memory. """
+        entries: dict[str, dict[str, Record]] = dict()
+
+        async with pool.acquire() as conn:
+            for entity in self.entities:
+                rows: list[Record] = await conn.fetch(
+                    f'SELECT {schema.columns[entity]} FROM {entity}')
+                entries[entity] = {self.normalize(r['name']): r for r in rows}
+
+        tries: dict[str, PrefixTrie] = {
+            entity: PrefixTrie(r['name'] for r in rows.values())
+            for entity, rows in entries.items()
+        }
+
+        names: dict[str, list[tuple[str, Record]]] = dict()
+        digest = hashlib.blake2b(digest_size=8)
+        for entity, rows in entries.items():
+            for key, row in sorted(rows.items()):
+                names.setdefault(key, []).append((entity, row))
+                digest.update(repr((entity, *row.values())).encode('utf-8'))
+
+        # Swap in one go so readers never see a partial index
+        self._entries = entries
+        self._tries = tries
+        self._names = names
+        self._all = PrefixTrie({r['name'] for e in entries.values() for r in e.values()})
+        self.version = digest.hexdigest()
+        log.info(f'Loaded compendium index with {len(self)} entries.')
+
+    def get(self, entity: str, name: str) -> Optional[Record]:
+        """ Returns the record whose normalized name matches exactly. """
+        return self._entries[entity].get(self.normalize(name))
+
+    def find(self, name: str) -> list[tuple[str, Record]]:
+        """ Returns every (entity, record) whose normalized name matches exactly. """
+        return self._names.get(self.normalize(name), [])
+
+    def complete(self, entity: str, query: str) -> list[str]:
+        """ Returns up to 25 names for autocompletion. """
+        return self._tries[entity].search(query)
+
+    def complete_any(self, query: str) -> list[str]:
+        """ Returns up to 25 names across every entity for autocompletion. """
+        return self._all.search(query)
+
+    def __len__(self) -> int:
+        return sum(len(e) for e in self._entries.values())
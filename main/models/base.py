@@ -3,9 +3,10 @@
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 from __future__ import annotations
 
+import discord
 import logging
 
-from abc import ABC
+from abc import ABC, abstractmethod
 
 
 log = logging.getLogger('__name__')
@@ -15,7 +16,44 @@ log = logging.getLogger('__name__')
 #                         Source
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 class Source(ABC):
-    ...
+    """ Base for compendium entity models. """
+    show_author: bool = True
+    # Bump whenever render() output changes so the ingest re-materializes rows
+    render_version: int = 1
+
+    @classmethod
+    def load(cls, record) -> list[discord.Embed]:
+        """ Returns the embeds materialized at ingest, rendering them only when
+        they are missing or were rendered by an older version. """
+        payload = record.get('embed')
+        if payload is not None and record.get('render_version') == cls.render_version:
+            return [discord.Embed.from_dict(data) for data in payload]
+
+        return cls(record).render()
+
+    def materialize(self) -> list[dict]:
+        """ Serialized embeds to store alongside the row. """
+        return [e.to_dict() for e in self.render()]
+
+    @abstractmethod
+    def render(self) -> list[discord.Embed]:
+        """ Builds the author independent embeds for the entry. """
+        ...
+
+    def gen_embed(self, author: discord.Member) -> list[discord.Embed]:
+        return self.decorate(self.render(), author)
+
+    @classmethod
+    def decorate(
+        cls, embeds: list[discord.Embed], author: discord.Member
+    ) -> list[discord.Embed]:
+        """ Applies the author header to a copy of already rendered embeds. """
+        if not cls.show_author:
+            return embeds
+
+        first = embeds[0].copy()
+        first.set_author(name=author.display_name, icon_url=author.display_avatar)
+        return [first, *embeds[1:]]
 
 
 class Trait:
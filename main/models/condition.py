@@ -27,6 +27,7 @@ log = logging.getLogger('__name__')
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 class Condition(Source):
     """ Model for feats entity type"""
+    show_author = False
     document_type = 'condition'
 
     def __init__(self, record: asyncpg.Record) -> None:
@@ -58,3 +59,6 @@ class Condition(Source):
         )
 
         return e
+
+    def render(self) -> list[discord.Embed]:
+        return [self.embed]
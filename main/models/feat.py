@@ -27,6 +27,7 @@ log = logging.getLogger('__name__')
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 class Feat(Source):
     """ Model for feats entity type"""
+    show_author = False
     document_type = 'feat'
 
     def __init__(self, record: asyncpg.Record) -> None:
@@ -61,3 +62,6 @@ class Feat(Source):
         )
 
         return e
+
+    def render(self) -> list[discord.Embed]:
+        return [self.embed]
@@ -7,7 +7,6 @@ from enum import Enum
 # Standard library imports
 import asyncpg
 import discord
-import json
 import logging
 
 from typing import TYPE_CHECKING, Any, Optional, TypedDict
@@ -59,7 +58,7 @@ class Maneuver(Source):
     def __init__(self, record: asyncpg.Record) -> None:
         self.name: str = record['name']
         self.description: str = record['description']
-        self.extras: ManeuverExtras = json.loads(record['extra'])
+        self.extras: ManeuverExtras = record['extra']
 
     @classmethod
     def from_record(
@@ -79,13 +78,12 @@ class Maneuver(Source):
     def __hash__(self) -> int:
         return hash(self.name)
 
-    def gen_embed(self, author: discord.Member) -> list[discord.Embed]:
+    def render(self) -> list[discord.Embed]:
         """ Generates embed for maneuver."""
 
         embeds: list[discord.Embed] = list()
         extras = self.extras
         e = discord.Embed(title=self.name, color=discord.Colour.random())
-        e.set_author(name=author.display_name, icon_url=author.display_avatar)
 
         # Add degree and tradition
         level = ordinal(extras['degree'])
@@ -7,7 +7,6 @@ from enum import Enum
 # Standard library imports
 import asyncpg
 import discord
-import json
 import logging
 
 from typing import TYPE_CHECKING, Any, Optional, TypedDict
@@ -51,6 +50,18 @@ class SpellRanges(Enum):
     long = 120
 
 
+class SpellSchools(Enum):
+    abjuration = 'Abjuration'
+    conjuration = 'Conjuration'
+    divination = 'Divination'
+    enchantment = 'Enchantment'
+    evocation = 'Evocation'
+    illusion = 'Illusion'
+    necromancy = 'Necromancy'
+    transformation = 'Transformation'
+    transmutation = 'Transmutation'
+
+
 class SpellTargets(Enum):
     self = 'Self'
     creature = 'Creature'
@@ -70,7 +81,7 @@ class Spell(Source):
         self.name: str = record['name']
         self.description: str = record['description']
         self.type: str = record['type']
-        self.extras: SpellExtras = json.loads(record['extra'])
+        self.extras: SpellExtras = record['extra']
 
     @classmethod
     def from_record(
@@ -92,7 +103,7 @@ class Spell(Source):
     def __hash__(self) -> int:
         return hash(self.name)
 
-    def gen_embed(self, author: discord.Member) -> list[discord.Embed]:
+    def render(self) -> list[discord.Embed]:
         """ Generates embed for spell."""
 
         embeds: list[discord.Embed] = list()
@@ -102,7 +113,6 @@ class Spell(Source):
             title=f'{self.name} {"(Rare)" if self.type == "rare" else ""}',
             color=discord.Color.random()
         )
-        e.set_author(name=author.display_name, icon_url=author.display_avatar)
 
         # Add level and type
 
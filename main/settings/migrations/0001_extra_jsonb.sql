@@ -0,0 +1,15 @@
+-- Skipped where extra is already jsonb, the generated columns reading it
+-- forbid altering its type
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'spells' AND column_name = 'extra') <> 'jsonb' THEN
+        ALTER TABLE spells ALTER COLUMN extra TYPE JSONB USING extra::jsonb;
+    END IF;
+
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'maneuvers' AND column_name = 'extra') <> 'jsonb' THEN
+        ALTER TABLE maneuvers ALTER COLUMN extra TYPE JSONB USING extra::jsonb;
+    END IF;
+END
+$$;
@@ -0,0 +1,10 @@
+ALTER TABLE spells
+    ADD COLUMN IF NOT EXISTS level INTEGER GENERATED ALWAYS AS (NULLIF(extra->>'level', '')::integer) STORED,
+    ADD COLUMN IF NOT EXISTS primary_school TEXT GENERATED ALWAYS AS (extra->>'primarySchool') STORED,
+    ADD COLUMN IF NOT EXISTS ritual BOOLEAN GENERATED ALWAYS AS ((extra->>'ritual')::boolean) STORED,
+    ADD COLUMN IF NOT EXISTS concentration BOOLEAN GENERATED ALWAYS AS ((extra->>'concentration')::boolean) STORED;
+
+ALTER TABLE maneuvers
+    ADD COLUMN IF NOT EXISTS tradition TEXT GENERATED ALWAYS AS (extra->>'tradition') STORED,
+    ADD COLUMN IF NOT EXISTS degree INTEGER GENERATED ALWAYS AS (NULLIF(extra->>'degree', '')::integer) STORED,
+    ADD COLUMN IF NOT EXISTS exertion_cost INTEGER GENERATED ALWAYS AS (NULLIF(extra->>'exertionCost', '')::integer) STORED;
@@ -0,0 +1,6 @@
+-- no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spells_filter_idx
+    ON spells (level, primary_school, ritual, concentration) INCLUDE (name);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS maneuvers_filter_idx
+    ON maneuvers (tradition, degree, exertion_cost) INCLUDE (name);
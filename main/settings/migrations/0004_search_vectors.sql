@@ -0,0 +1,19 @@
+ALTER TABLE feats ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', name), 'A') ||
+    setweight(to_tsvector('english', description), 'B')
+) STORED;
+
+ALTER TABLE conditions ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', name), 'A') ||
+    setweight(to_tsvector('english', description), 'B')
+) STORED;
+
+ALTER TABLE maneuvers ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', name), 'A') ||
+    setweight(to_tsvector('english', description), 'B')
+) STORED;
+
+ALTER TABLE spells ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', name), 'A') ||
+    setweight(to_tsvector('english', description), 'B')
+) STORED;
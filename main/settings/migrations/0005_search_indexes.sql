@@ -0,0 +1,5 @@
+-- no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS feats_search_idx ON feats USING GIN (search);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS conditions_search_idx ON conditions USING GIN (search);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS maneuvers_search_idx ON maneuvers USING GIN (search);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spells_search_idx ON spells USING GIN (search);
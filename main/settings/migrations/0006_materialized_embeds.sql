@@ -0,0 +1,15 @@
+ALTER TABLE feats
+    ADD COLUMN IF NOT EXISTS embed JSONB,
+    ADD COLUMN IF NOT EXISTS render_version INTEGER;
+
+ALTER TABLE conditions
+    ADD COLUMN IF NOT EXISTS embed JSONB,
+    ADD COLUMN IF NOT EXISTS render_version INTEGER;
+
+ALTER TABLE maneuvers
+    ADD COLUMN IF NOT EXISTS embed JSONB,
+    ADD COLUMN IF NOT EXISTS render_version INTEGER;
+
+ALTER TABLE spells
+    ADD COLUMN IF NOT EXISTS embed JSONB,
+    ADD COLUMN IF NOT EXISTS render_version INTEGER;
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS ingest_files(
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    ingested_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+);
+
+ALTER TABLE feats ADD COLUMN IF NOT EXISTS row_hash TEXT;
+ALTER TABLE conditions ADD COLUMN IF NOT EXISTS row_hash TEXT;
+ALTER TABLE maneuvers ADD COLUMN IF NOT EXISTS row_hash TEXT;
+ALTER TABLE spells ADD COLUMN IF NOT EXISTS row_hash TEXT;
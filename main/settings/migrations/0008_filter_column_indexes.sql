@@ -0,0 +1,17 @@
+-- no-transaction
+-- The composite filter indexes only serve queries on their leading column,
+-- these cover every other filter on its own
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spells_school_idx
+    ON spells (primary_school, level) INCLUDE (name);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spells_ritual_idx
+    ON spells (level) INCLUDE (name) WHERE ritual;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spells_concentration_idx
+    ON spells (level) INCLUDE (name) WHERE concentration;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS maneuvers_degree_idx
+    ON maneuvers (degree, exertion_cost) INCLUDE (tradition, name);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS maneuvers_exertion_cost_idx
+    ON maneuvers (exertion_cost) INCLUDE (tradition, degree, name);
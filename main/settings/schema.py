@@ -1,34 +1,169 @@
 cogs: list = []
 
 
+# Ordered <version>_<name>.sql files applied by DB.migrate
+migrations: str = 'main/settings/migrations'
+
+
+# Notified by the ingest once the compendium tables change
+compendium_channel: str = 'compendium_updated'
+
+
+# Tables as they were before the first migration. A new database starts from
+# these and replays every migration, so this must never change.
+baseline: dict = {
+    'feats': '''
+        name TEXT PRIMARY KEY,
+        perquisite TEXT,
+        description TEXT NOT NULL,
+        type TEXT
+    ''',
+
+    'conditions': '''
+        name TEXT PRIMARY KEY,
+        description TEXT NOT NULL
+    ''',
+
+    'maneuvers': '''
+        name TEXT PRIMARY KEY,
+        description TEXT NOT NULL,
+        extra JSON DEFAULT '{}'::jsonb
+    ''',
+
+    'spells': '''
+        name TEXT PRIMARY KEY,
+        description TEXT NOT NULL,
+        type TEXT,
+        extra JSON DEFAULT '{}'::jsonb
+    '''
+}
+
+
+# Weighted full text document, maintained by postgres on every write
+search_column: str = '''search TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', name), 'A') ||
+            setweight(to_tsvector('english', description), 'B')
+        ) STORED'''
+
+
+# Current shape of the tables, once every migration is applied
 tables: dict = {
     'feats': f'''
         name TEXT PRIMARY KEY,
         perquisite TEXT,
         description TEXT NOT NULL,
-        type TEXT
+        type TEXT,
+        embed JSONB,
+        render_version INTEGER,
+        row_hash TEXT,
+        {search_column}
     ''',
 
     'conditions': f'''
         name TEXT PRIMARY KEY,
-        description TEXT NOT NULL
+        description TEXT NOT NULL,
+        embed JSONB,
+        render_version INTEGER,
+        row_hash TEXT,
+        {search_column}
     ''',
 
     'maneuvers': f'''
         name TEXT PRIMARY KEY,
         description TEXT NOT NULL,
-        extra JSON DEFAULT '{{}}'::jsonb
+        extra JSONB DEFAULT '{{}}'::jsonb,
+        tradition TEXT GENERATED ALWAYS AS (extra->>'tradition') STORED,
+        degree INTEGER GENERATED ALWAYS AS (NULLIF(extra->>'degree', '')::integer) STORED,
+        exertion_cost INTEGER GENERATED ALWAYS AS (NULLIF(extra->>'exertionCost', '')::integer) STORED,
+        embed JSONB,
+        render_version INTEGER,
+        row_hash TEXT,
+        {search_column}
     ''',
 
     'spells': f'''
         name TEXT PRIMARY KEY,
         description TEXT NOT NULL,
         type TEXT,
-        extra JSON DEFAULT '{{}}'::jsonb
+        extra JSONB DEFAULT '{{}}'::jsonb,
+        level INTEGER GENERATED ALWAYS AS (NULLIF(extra->>'level', '')::integer) STORED,
+        primary_school TEXT GENERATED ALWAYS AS (extra->>'primarySchool') STORED,
+        ritual BOOLEAN GENERATED ALWAYS AS ((extra->>'ritual')::boolean) STORED,
+        concentration BOOLEAN GENERATED ALWAYS AS ((extra->>'concentration')::boolean) STORED,
+        embed JSONB,
+        render_version INTEGER,
+        row_hash TEXT,
+        {search_column}
     '''
 }
 
+
+# Columns the models are built from
+columns: dict[str, str] = {
+    'feats': 'name, description, type, embed, render_version',
+    'conditions': 'name, description, embed, render_version',
+    'maneuvers': 'name, description, extra, embed, render_version',
+    'spells': 'name, description, type, extra, embed, render_version',
+}
+
+
+# Exact matches rank first, followed by trigram matches, in one round trip
+lookup: str = '''
+    SELECT      {columns}
+    FROM        {entity}
+    WHERE       LOWER(name) = $1 OR name % $1
+    ORDER BY    LOWER(name) = $1 DESC, similarity(name, $1) DESC
+    LIMIT       15
+'''
+
+
+# Exact and trigram matches across every entity in one round trip
+lookup_any: str = '''
+    SELECT      entity, name
+    FROM        ({hits}) AS hits
+    ORDER BY    LOWER(name) = $1 DESC, similarity(name, $1) DESC
+    LIMIT       15
+'''.format(hits=' UNION ALL '.join(
+    f"SELECT '{table}' AS entity, name FROM {table} WHERE LOWER(name) = $1 OR name % $1"
+    for table in tables
+))
+
+
+# Ranked full text search over every entity, snippets only for the top hits
+search: str = '''
+    WITH query AS (SELECT websearch_to_tsquery('english', $1) AS q),
+    hits AS (
+        {hits}
+        ORDER BY rank DESC
+        LIMIT 25
+    )
+    SELECT      entity, name, rank,
+                ts_headline('english', description, q,
+                            'MaxFragments=1, MinWords=5, MaxWords=20, StartSel=**, StopSel=**') AS snippet
+    FROM        hits, query
+    ORDER BY    rank DESC
+'''.format(hits='\n        UNION ALL\n        '.join(
+    f"SELECT '{table}' AS entity, name, description, ts_rank(search, q) AS rank "
+    f"FROM {table}, query WHERE search @@ q"
+    for table in tables
+))
+
+
+# Named statements prepared on every pool connection
+statements: dict[str, str] = {
+    f'lookup_{table}': lookup.format(entity=table, columns=columns[table])
+    for table in tables
+}
+statements['lookup_any'] = lookup_any
+statements['search'] = search
+
+
+# Name lookup indexes for every entity table
 indexes: list[str] = [
-    'CREATE INDEX IF NOT EXISTS feats_name_trgm_idx ON feats USING GIN (name gin_trgm_ops)',
-    'CREATE INDEX IF NOT EXISTS feats_name_lower_idx ON feats (LOWER(name))'
+    sql
+    for table in tables
+    for sql in (
+        f'CREATE INDEX IF NOT EXISTS {table}_name_trgm_idx ON {table} USING GIN (name gin_trgm_ops)',
+        f'CREATE INDEX IF NOT EXISTS {table}_name_lower_idx ON {table} (LOWER(name))',
+    )
 ]